@@ -1,6 +1,11 @@
 from __future__ import print_function
 import visa
 
+from scopeExceptions import CommunicationException, TimeoutException
+import synchronization
+import metrics
+import transport
+
 """
 IMPORTANT: install pyVisa ! (e.g via pip install pyVisa). this requires that the NI-Visa driver is already installed
 """
@@ -12,8 +17,24 @@ def list_devices():
     rm = visa.ResourceManager()
     print(rm.list_resources())
     
-class GPIBComm:
-    def __init__(self, address, timeout=2000, eol='\r\n'):
+def _io_error(e):
+    """Translate a VISA error into the exceptions of scopeExceptions"""
+    if e.error_code == visa.constants.VI_ERROR_TMO:
+        return TimeoutException(str(e))
+    return CommunicationException(str(e))
+
+class GPIBComm(transport.Transport):
+    """
+    VISA connection to the oszi (GPIB, or any other VISA resource)
+
+    Keyword arguments:
+    timeout - session timeout in ms
+    chunk_size - size in bytes of the single reads of VISA (default: the VISA default of
+                 20 kB). A whole curve (up to 5 kB, 2 channels 10 kB) fits into one chunk
+                 anyway; raise it for long records or slow backends with a high cost per read.
+    """
+
+    def __init__(self, address, timeout=2000, eol='\r\n', chunk_size=None):
         rm = visa.ResourceManager()
         try:
             self.inst = rm.open_resource(address)#, read_termination=eol)
@@ -22,32 +43,110 @@ class GPIBComm:
             
         if timeout:
             self.inst.timeout = timeout
+        if chunk_size:
+            self.inst.chunk_size = chunk_size
+        self.timeout = self.inst.timeout/1000.0
+        self.metrics = metrics.NULL_METRICS #see metrics.py
 
         self.do_init_oszi()    
     
     def do_init_oszi(self):
         self.writeline("*CLS") #clear status
 
-    def readline(self):
-        return self.inst.read()
+    def readline(self, timeout=None):
+        oldTimeout = self.inst.timeout
+        if timeout is not None:
+            self.inst.timeout = timeout*1000
+        try:
+            result = self.inst.read()
+            self.metrics.count("bytes_read", len(result))
+            return result
+        except visa.VisaIOError as e:
+            raise _io_error(e)
+        finally:
+            self.inst.timeout = oldTimeout
         
     def read(self, bytes=1):
         return self.readline_raw()
         #return self.connection.read(bytes)
         
-    def readline_raw(self):
+    def readline_raw(self, min_bytes=0):
         return self.inst.read_raw()
 
+    def read_block(self, expected_bytes=None, timeout=None):
+        """
+        Read an IEEE-488.2 definite length block, e.g. the answer to "CURV?"
+
+        The leading response header (e.g. ':CURVE ') and noise in front of the block
+        are skipped (see transport.BlockHeader) and only the announced number of data
+        bytes is returned.
+
+        Keyword arguments:
+        expected_bytes - if given, the announced block length must match this value
+        timeout - timeout in sec for the read (default: the session timeout)
+        """
+        oldTimeout = self.inst.timeout
+        if timeout is not None:
+            self.inst.timeout = timeout*1000
+        try:
+            raw = self.inst.read_raw()
+        except visa.VisaIOError as e:
+            raise _io_error(e)
+        finally:
+            self.inst.timeout = oldTimeout
+        self.metrics.count("bytes_read", len(raw))
+        start, length = transport.find_block(raw, expected_bytes)
+        if length is None:
+            return raw[start:].rstrip(b'\r\n')
+        data = raw[start:start+length]
+        if len(data) < length:
+            raise CommunicationException("Block is incomplete: got {:d} of {:d} bytes".format(len(data), length))
+        return data
+
+    def read_stb(self):
+        """Serial poll: return the status byte without sending a message to the oszi"""
+        return self.inst.read_stb()
+
+    def wait_ready(self, timeout=None):
+        """Block until the oszi has finished all pending operations (status byte handshake)"""
+        synchronization.wait_status_byte(self, self.inst.timeout/1000.0 if timeout is None else timeout)
+
+    def wait_acquisition(self, timeout=None):
+        """
+        Block until a single sequence acquisition is complete
+
+        The completion of the sequence is an operation complete event, so the
+        status byte is polled like in wait_ready, with a longer maximum interval.
+        """
+        synchronization.wait_status_byte(self, self.inst.timeout/1000.0 if timeout is None else timeout,
+                                         max_interval=0.2)
+
+    def clear(self):
+        """Device clear: the oszi drops pending answers, e.g. of an interrupted read"""
+        self.inst.clear()
+
+    def resync(self, timeout=None):
+        """The device clear also empties the output queue of the oszi, so nothing is left to skip"""
+        self.clear()
+
+    def close(self):
+        self.inst.close()
+
     def write(self, message):
         self.writeline(message)
     
     def writeline(self, message):
         self.inst.write(message) #will append eol chars
+        self.metrics.count("bytes_written", len(message)+2)
         
     def query(self, msg, timeout=None):
         oldTimeout = self.inst.timeout
         if timeout:
-            self.inst.timeout = timeout
-        result = self.inst.query(msg)
-        self.inst.timeout = oldTimeout
+            self.inst.timeout = timeout*1000
+        try:
+            result = self.inst.query(msg)
+        except visa.VisaIOError as e:
+            raise _io_error(e)
+        finally:
+            self.inst.timeout = oldTimeout
         return result    
\ No newline at end of file
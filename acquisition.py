@@ -0,0 +1,205 @@
+"""
+Continuous acquisition into a preallocated ring buffer
+
+The frames are decoded directly into a fixed number of preallocated numpy arrays,
+so a long running acquisition does not allocate new arrays for every frame.
+
+usage (blocking generator, see Scope.stream):
+    for frame in myscope.stream("CH1CH2"):
+        print(frame.timestamp, frame.data[0].max())
+
+usage (background thread, see Scope.start_stream):
+    acq = myscope.start_stream("CH1", buffer_size=16)
+    frame = acq.get(timeout=10)
+    print(frame.dropped, "frames were dropped before this one")
+    acq.stop()
+"""
+
+from __future__ import print_function
+import collections
+import threading
+import time
+import numpy as np
+
+from scopeExceptions import TimeoutException
+
+Frame = collections.namedtuple('Frame', ['index', 'timestamp', 'x', 'data', 'dropped'])
+Frame.__doc__ = """One acquired frame
+
+index - running number of the frame (counting also the dropped ones)
+timestamp - host time (time.time()) when the oszi was frozen
+x - view of the time axis
+data - view of the data in Volts, shape (number of channels, number of points)
+dropped - number of frames that were overwritten before the consumer could get them
+          since the previous frame returned by get()
+"""
+
+
+class FrameRingBuffer:
+    """
+    Fixed size ring of preallocated frames
+
+    The producer claims a free slot, writes the data into ring.data[slot] and ring.x[slot]
+    and publishes it. The consumer gets the published frames in order.
+    The slot of the frame last returned by get() is never overwritten until the next
+    call of get(), so the returned views stay valid until then.
+
+    If the consumer is too slow, the behaviour depends on overwrite:
+    overwrite=True - the oldest unread frame is overwritten and counted as dropped
+    overwrite=False - the producer blocks in claim() (backpressure) and the time it
+                      had to wait is summed up in blocked_time
+    """
+
+    def __init__(self, size, n_channels, n_points, dtype=np.float64, overwrite=True):
+        if size < 2:
+            raise ValueError("The ring buffer needs at least 2 slots")
+        self.size = size
+        self.overwrite = overwrite
+        self.data = np.zeros((size, n_channels, n_points), dtype=dtype)
+        self.x = np.zeros((size, n_points))
+        self.timestamps = np.zeros(size)
+
+        self.dropped = 0         #total number of dropped frames
+        self.blocked_time = 0.0  #total time the producer waited for a free slot
+        self._dropped_since_get = 0
+        self._published = collections.deque() #slots (with frame index) ready to be read
+        self._held = None        #slot last returned to the consumer
+        self._count = 0          #number of frames published so far
+        self._next = 0           #slot to start the search for a free slot
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+
+    def _free_slot(self):
+        #search round robin, so a frame stays in the ring as long as possible
+        busy = set(slot for slot, index in self._published)
+        busy.add(self._held)
+        for i in range(self.size):
+            slot = (self._next + i) % self.size
+            if slot not in busy:
+                self._next = slot + 1
+                return slot
+        return None
+
+    def claim(self, timeout=None):
+        """Return the index of a slot the producer can write the next frame into"""
+        with self._cond:
+            slot = self._free_slot()
+            if slot is None and self.overwrite:
+                slot, index = self._published.popleft()
+                self.dropped += 1
+                self._dropped_since_get += 1
+            elif slot is None:
+                t0 = time.time()
+                while slot is None:
+                    remaining = None if timeout is None else timeout - (time.time() - t0)
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutException("No free slot in the ring buffer")
+                    self._cond.wait(remaining)
+                    slot = self._free_slot()
+                self.blocked_time += time.time() - t0
+            return slot
+
+    def publish(self, slot, timestamp):
+        """Mark the claimed slot as filled"""
+        with self._cond:
+            self.timestamps[slot] = timestamp
+            self._published.append((slot, self._count))
+            self._count += 1
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Return the next published frame (oldest first) or raise a TimeoutException
+
+        The returned arrays are views into the ring, copy them if they are needed
+        longer than until the next call of get().
+        """
+        with self._cond:
+            t0 = time.time()
+            while not self._published:
+                if self._closed:
+                    raise self._error or TimeoutException("The acquisition was stopped")
+                remaining = None if timeout is None else timeout - (time.time() - t0)
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutException("No frame available")
+                self._cond.wait(remaining)
+            slot, index = self._published.popleft()
+            self._held = slot
+            dropped = self._dropped_since_get
+            self._dropped_since_get = 0
+            self._cond.notify_all()
+            return Frame(index, self.timestamps[slot], self.x[slot], self.data[slot], dropped)
+
+    def close(self, error=None):
+        """No more frames will be published, wake up a waiting consumer"""
+        with self._cond:
+            self._closed = True
+            self._error = error
+            self._cond.notify_all()
+
+    def discard(self):
+        """
+        Drop the published frames not read yet and release the slot held by the consumer
+
+        Wakes up a producer blocked in claim(). The discarded frames are counted as dropped.
+        """
+        with self._cond:
+            n = len(self._published)
+            self.dropped += n
+            self._dropped_since_get += n
+            self._published.clear()
+            self._held = None
+            self._cond.notify_all()
+
+    def pending(self):
+        """Number of published frames not yet read by the consumer"""
+        with self._cond:
+            return len(self._published)
+
+
+class AcquisitionThread(threading.Thread):
+    """
+    Background thread reading frames from the scope into a FrameRingBuffer
+
+    Use Scope.start_stream() to create it. Exceptions inside the thread stop the
+    acquisition and are raised again by the next call of get().
+    """
+
+    def __init__(self, scope, channel="CH1", fast_mode=True, buffer_size=8, overwrite=True, window=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.scope = scope
+        self.channels = scope._parse_channels(channel)
+        self.byte_wid = 1 if fast_mode else 2
+        self.window = scope._record_window() if window is None else window
+        self.ring = FrameRingBuffer(buffer_size, len(self.channels), scope._window_points(self.window), overwrite=overwrite)
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                slot = self.ring.claim()
+                timestamp, x, data = self.scope._retry(self.scope._acquire, self.channels, self.byte_wid, self.window,
+                                                       False, self.ring.data[slot], self.ring.x[slot])
+                self.ring.publish(slot, timestamp)
+            self.ring.close()
+        except Exception as e:
+            self.error = e
+            self.ring.close(e)
+
+    def get(self, timeout=None):
+        """Return the next Frame, see FrameRingBuffer.get()"""
+        return self.ring.get(timeout)
+
+    @property
+    def dropped(self):
+        return self.ring.dropped
+
+    def stop(self, timeout=None):
+        """Stop the acquisition and wait for the thread to finish"""
+        self._stop_event.set()
+        if not self.ring.overwrite:
+            self.ring.discard() #release a producer waiting for a free slot
+        self.join(timeout)
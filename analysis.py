@@ -0,0 +1,415 @@
+"""
+Incremental analysis of acquired frames
+
+The stages keep running statistics of the frames and are updated with every new
+frame, so nothing has to be recomputed from the stored frames. Each stage holds only
+a few arrays of the size of one frame, so the memory stays the same no matter how
+many frames were processed (e.g. a monitor running for days).
+
+Stages:
+    Mean - running (or exponentially weighted) average per point
+    Envelope - minimum and maximum per point
+    RMS - root mean square per point and per channel
+    Frequency - frequency of the signal from its rising edges
+    Spectrum - averaged amplitude spectrum (FFT)
+    FrameAverage - average of every n frames, passed on to the following stages
+
+usage:
+    stats = analysis.Pipeline(analysis.Mean(), analysis.Envelope(), analysis.Frequency())
+    for frame in myscope.stream("CH1CH2"):
+        stats.update(frame.data, frame.x)
+    mean, frequency = stats[0].result, stats[2].result
+
+    x, ch1, ch2 = myscope.readScope("CH1CH2")
+    stats.update([ch1, ch2], x)             #one frame, shape (channels, points)
+    stats.feed(myscope.read_batch(100, "CH1CH2")) #a batch is processed in chunks of frames
+
+The stages process several frames at once (shape (frames, channels, points)) with
+one numpy operation each. The results per point are on the time axis x of the
+frames (Stage.x, as built by readScope from XZERO and XINCR), Spectrum.frequencies
+is derived from XINCR. A frame with a different shape or time axis (e.g. after
+config_time) restarts the statistics.
+"""
+
+import numpy as np
+
+from scopeExceptions import InvalidArgumentException
+
+def _frames(data):
+    """Return data as array of shape (frames, channels, points)"""
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim == 1:
+        return data[np.newaxis, np.newaxis]
+    if data.ndim == 2:
+        return data[np.newaxis]
+    return data
+
+def _update_mean(mean, count, data, window):
+    """
+    Fold the frames data (frames, ...) into the mean of count frames, returns the new mean
+
+    window None: all frames have the same weight, otherwise exponential weighting with
+    a time constant of window frames
+    """
+    if mean is None:
+        mean = data[0].copy() #the first frame is not mixed with a mean of zero
+        data = data[1:]
+        count = 1
+    k = len(data)
+    if not k:
+        return mean
+    if window is None:
+        mean *= count/float(count+k)
+        mean += data.sum(0)/(count+k)
+    else:
+        a = 1.0/window
+        mean *= (1-a)**k
+        mean += np.tensordot(a*(1-a)**np.arange(k-1, -1, -1), data, axes=1)
+    return mean
+
+def frame_frequency(data, xincr=1.0, hysteresis=0.25):
+    """
+    Frequency of every frame from the distance of its first and its last rising edge
+
+    An edge is a rise from below to above the band of hysteresis*(peak-to-peak)
+    around the middle of the frame (like a Schmitt trigger), so noise does not add
+    edges. The edge times are interpolated linearly between the samples.
+
+    Arguments:
+    data - Volts, shape (frames, channels, points)
+
+    Keyword arguments:
+    xincr - time between the points in sec (XINCR)
+
+    Returns an array (frames, channels) in Hz, nan for frames with less than 2 edges.
+    """
+    n = data.shape[-1]
+    high = data.max(-1)[..., np.newaxis]
+    low = data.min(-1)[..., np.newaxis]
+    band = (high - low)*hysteresis/2
+    upper = (high + low)/2 + band
+    state = (data > upper).astype(np.int8)
+    state -= data < upper - 2*band
+    #samples inside the band keep the state of the last sample outside of it
+    last = np.where(state != 0, np.arange(n), 0)
+    np.maximum.accumulate(last, axis=-1, out=last)
+    state = np.take_along_axis(state, last, -1)
+    rising = (state[..., :-1] < 0) & (state[..., 1:] > 0)
+    edges = rising.sum(-1)
+
+    def edge_time(i):
+        i = i[..., np.newaxis]
+        d0 = np.take_along_axis(data, i, -1)
+        d1 = np.take_along_axis(data, i+1, -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (i + (upper - d0)/(d1 - d0))[..., 0]
+
+    first = edge_time(rising.argmax(-1))
+    last = edge_time(n - 2 - rising[..., ::-1].argmax(-1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frequency = (edges - 1)/((last - first)*xincr)
+    frequency[edges < 2] = np.nan
+    return frequency
+
+
+class Stage(object):
+    """
+    Base class of the stages
+
+    process(data, x) updates the stage with the frames data (frames, channels, points)
+    and returns (data, x) for the next stage of the pipeline.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget all frames"""
+        self.count = 0  #number of frames processed
+        self.x = None   #time axis of the frames
+        self._key = None
+
+    def _update(self, data):
+        raise NotImplementedError
+
+    def process(self, data, x=None):
+        key = (data.shape[1:], None if x is None else (len(x), x[0], x[-1]))
+        if key != self._key:
+            self.reset()
+            self._key = key
+        self.x = x
+        self._update(data)
+        self.count += len(data)
+        return data, x
+
+    @property
+    def xincr(self):
+        return 1.0 if self.x is None or len(self.x) < 2 else float(self.x[1] - self.x[0])
+
+
+class Mean(Stage):
+    """
+    Average of the frames per point, result has the shape (channels, points)
+
+    Keyword arguments:
+    window - None: average of all frames, otherwise an exponential moving average
+             with a time constant of window frames
+    """
+
+    def __init__(self, window=None):
+        if window is not None and window < 1:
+            raise InvalidArgumentException("The window has to be at least 1 frame")
+        self.window = window
+        Stage.__init__(self)
+
+    def reset(self):
+        Stage.reset(self)
+        self.result = None
+
+    def _update(self, data):
+        self.result = _update_mean(self.result, self.count, data, self.window)
+
+
+class Envelope(Stage):
+    """Minimum and maximum of the frames per point: result = (min, max), each (channels, points)"""
+
+    def reset(self):
+        Stage.reset(self)
+        self.min = None
+        self.max = None
+
+    def _update(self, data):
+        if self.min is None:
+            self.min = data.min(0)
+            self.max = data.max(0)
+        else:
+            np.minimum(self.min, data.min(0), out=self.min)
+            np.maximum(self.max, data.max(0), out=self.max)
+
+    @property
+    def result(self):
+        return self.min, self.max
+
+
+class RMS(Stage):
+    """
+    Root mean square of the frames
+
+    result - per point over all frames, shape (channels, points)
+    value - over all points of all frames, one value per channel
+    """
+
+    def reset(self):
+        Stage.reset(self)
+        self._squares = None #sum of the squares per point
+
+    def _update(self, data):
+        squares = np.einsum('fcn,fcn->cn', data, data)
+        if self._squares is None:
+            self._squares = squares
+        else:
+            self._squares += squares
+
+    @property
+    def result(self):
+        return None if self._squares is None else np.sqrt(self._squares/self.count)
+
+    @property
+    def value(self):
+        return None if self._squares is None else np.sqrt(self._squares.mean(-1)/self.count)
+
+
+class Frequency(Stage):
+    """
+    Frequency of the signal per channel, see frame_frequency
+
+    result - average over the frames with a valid estimate in Hz, one value per channel
+    last - estimate of the last frame
+    period - 1/result in sec
+    """
+
+    def __init__(self, hysteresis=0.25):
+        self.hysteresis = hysteresis
+        Stage.__init__(self)
+
+    def reset(self):
+        Stage.reset(self)
+        self.last = None
+        self._sum = None
+        self._valid = None #number of frames with an estimate per channel
+
+    def _update(self, data):
+        frequency = frame_frequency(data, self.xincr, self.hysteresis)
+        valid = ~np.isnan(frequency)
+        if self._sum is None:
+            self._sum = np.zeros(frequency.shape[1])
+            self._valid = np.zeros(frequency.shape[1], dtype=int)
+        self._sum += np.where(valid, frequency, 0).sum(0)
+        self._valid += valid.sum(0)
+        self.last = frequency[-1]
+
+    @property
+    def result(self):
+        if self._sum is None:
+            return None
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._sum/self._valid
+
+    @property
+    def period(self):
+        result = self.result
+        return None if result is None else 1/result
+
+
+class Spectrum(Stage):
+    """
+    Averaged amplitude spectrum of the frames (Hann window)
+
+    The power of the spectra is averaged, result is the amplitude in V (peak) per
+    frequency, shape (channels, points//2+1), on the axis frequencies in Hz.
+
+    Keyword arguments:
+    window - None: average of all frames, otherwise an exponential moving average
+             with a time constant of window frames
+    """
+
+    def __init__(self, window=None):
+        if window is not None and window < 1:
+            raise InvalidArgumentException("The window has to be at least 1 frame")
+        self.window = window
+        Stage.__init__(self)
+
+    def reset(self):
+        Stage.reset(self)
+        self._power = None
+        self._taper = None
+
+    def _update(self, data):
+        if self._taper is None:
+            self._taper = np.hanning(data.shape[-1])
+        power = np.abs(np.fft.rfft(data*self._taper, axis=-1))
+        power **= 2
+        self._power = _update_mean(self._power, self.count, power, self.window)
+
+    @property
+    def result(self):
+        if self._power is None:
+            return None
+        return np.sqrt(self._power)*(2/self._taper.sum())
+
+    @property
+    def frequencies(self):
+        if self._taper is None:
+            return None
+        return np.fft.rfftfreq(len(self._taper), self.xincr)
+
+
+class FrameAverage(Stage):
+    """
+    Average every n frames and pass only the averages on to the following stages
+
+    E.g. Pipeline(FrameAverage(16), Spectrum()) averages the triggered waveforms before
+    the FFT, which lowers the noise floor (the spectra of the single frames are not
+    averaged). A started average is kept until the next call.
+    """
+
+    def __init__(self, n):
+        if n < 1:
+            raise InvalidArgumentException("n has to be at least 1")
+        self.n = n
+        Stage.__init__(self)
+
+    def reset(self):
+        Stage.reset(self)
+        self._sum = None
+        self._filled = 0 #frames in _sum
+
+    def _update(self, data):
+        pass
+
+    def process(self, data, x=None):
+        Stage.process(self, data, x)
+        if self._sum is None:
+            self._sum = np.zeros(data.shape[1:])
+        averages = []
+        i = 0
+        while i < len(data):
+            k = min(self.n - self._filled, len(data) - i)
+            self._sum += data[i:i+k].sum(0)
+            self._filled += k
+            i += k
+            if self._filled == self.n:
+                averages.append(self._sum/self.n)
+                self._sum[:] = 0
+                self._filled = 0
+        return np.array(averages).reshape((len(averages),) + data.shape[1:]), x
+
+
+class Pipeline(object):
+    """
+    Chain of stages, every stage gets the output of the previous one
+
+    The stages are available as pipeline[i] or pipeline.stages.
+    """
+
+    def __init__(self, *stages):
+        self.stages = list(stages)
+        self._buffer = None #frames copied out of a ring buffer, see drain()
+
+    def __getitem__(self, index):
+        return self.stages[index]
+
+    def __len__(self):
+        return len(self.stages)
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def update(self, data, x=None):
+        """
+        Process frames
+
+        data - Volts, shape (points,), (channels, points) or (frames, channels, points)
+        x - the time axis of the frames (e.g. from readScope or Frame.x)
+        """
+        data = _frames(data)
+        for stage in self.stages:
+            if not len(data):
+                break
+            data, x = stage.process(data, x)
+
+    def feed(self, source, chunk=64):
+        """
+        Process a waveform.WaveformBatch (in chunks of frames) or an iterable of acquisition.Frame
+
+        The frames of a chunk are assumed to have the same time axis as its first frame.
+        """
+        if hasattr(source, 'volts'):
+            for i in range(0, len(source), chunk):
+                self.update(source.volts(slice(i, i+chunk)), source.x(i))
+        else:
+            for frame in source:
+                self.update(frame.data, frame.x)
+
+    def drain(self, acq, timeout=None, max_frames=64):
+        """
+        Process the frames of an AcquisitionThread (see Scope.start_stream)
+
+        Waits up to timeout sec for the next frame, then takes all frames already
+        waiting in the ring buffer (at most max_frames) and processes them at once.
+        Returns the number of frames processed.
+        """
+        frame = acq.get(timeout)
+        if self._buffer is None or self._buffer.shape[1:] != frame.data.shape or len(self._buffer) < max_frames:
+            self._buffer = np.empty((max_frames,) + frame.data.shape)
+        x = np.array(frame.x)
+        n = 0
+        while True:
+            self._buffer[n] = frame.data #the ring may reuse the slot after the next get()
+            n += 1
+            if n == max_frames or not acq.ring.pending():
+                break
+            frame = acq.get(0)
+        self.update(self._buffer[:n], x)
+        return n
@@ -0,0 +1,391 @@
+"""
+asyncio interface of the oszi (Python 3.5+)
+
+AsyncScope offers readScope, config_* and get_*_config of scope.Scope as coroutines,
+so the event loop keeps running while the oszi is read:
+
+    async def main():
+        myscope = await asyncScope.AsyncScope.open("COM1")
+        x, data = await myscope.readScope("CH1", timeout=5)
+        myscope.close()
+
+Connections:
+    serial - AsyncSerialComm, an asyncio serial stream (needs pyserial-asyncio)
+    all others - ExecutorComm, runs the blocking calls of the connection of
+                 transport.open_transport (GPIBComm, SocketComm, ...) in a worker thread
+
+All reads have a timeout and raise a scopeExceptions.TimeoutException. If a read is
+cancelled or times out, the rest of the answer is dropped before the next command
+and the oszi is unfrozen again (ACQ:STATE 1).
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import functools
+
+from scopeExceptions import CommunicationException, TimeoutException
+import scope
+import transport
+import synchronization
+import waveform
+import metrics
+
+async def _wait(coro, timeout, metrics):
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        metrics.count("timeouts")
+        raise TimeoutException("The oszi did not answer within {:.2f}sec".format(timeout))
+
+
+class AsyncSerialComm:
+    """
+    Serial connection based on an asyncio stream, with the interface of SerialComm as coroutines
+
+    Use the coroutine AsyncSerialComm.open() to create it.
+    """
+
+    def __init__(self, reader, writer, timeout=5, eol='\r\n'):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.eol = eol
+        self.b_eol = eol.encode('ascii')
+        self.metrics = metrics.NULL_METRICS #see metrics.py
+        self._dirty = False #a read was interrupted, the rest of the answer has to be dropped
+
+    @classmethod
+    async def open(cls, address, baudrate=9600, timeout=5, eol='\r\n'):
+        try:
+            import serial_asyncio
+        except ImportError:
+            raise ImportError("The asyncio serial connection needs pyserial-asyncio (pip install pyserial-asyncio)")
+        reader, writer = await serial_asyncio.open_serial_connection(url=address, baudrate=baudrate)
+        con = cls(reader, writer, timeout, eol)
+        await con.do_init_oszi()
+        return con
+
+    async def do_init_oszi(self):
+        await self.writeline("*CLS") #clear status
+        await self.writeline("RS232:TRANS:TERM CRLF") #config OSZI line termination characters
+
+    async def _read(self, coro, timeout):
+        """Wait for a read, an interrupted read leaves the rest of the answer in the stream"""
+        try:
+            return await _wait(coro, self.timeout if timeout is None else timeout, self.metrics)
+        except BaseException:
+            self._dirty = True
+            raise
+
+    def drop_pending(self):
+        """Drop the answers not read yet before the next command, e.g. after a cancelled query"""
+        self._dirty = True
+
+    async def clear(self, quiet=0.2):
+        """Drop everything the oszi sends until the line is quiet for quiet sec"""
+        while True:
+            try:
+                data = await asyncio.wait_for(self.reader.read(4096), quiet)
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                break
+        self._dirty = False
+
+    async def writeline(self, message):
+        if self._dirty:
+            await self.clear()
+        data = (message+self.eol).encode('ascii')
+        self.writer.write(data)
+        await self.writer.drain()
+        self.metrics.count("bytes_written", len(data))
+
+    async def readline(self, timeout=None):
+        out = await self._read(self.reader.readuntil(self.b_eol), timeout)
+        self.metrics.count("bytes_read", len(out))
+        return out.decode('ascii').replace(self.eol, '\n')
+
+    async def read_block(self, expected_bytes=None, timeout=None):
+        """Read an IEEE-488.2 definite length block, see SerialComm.read_block"""
+        data = await self._read(self._read_block(expected_bytes), timeout)
+        self.metrics.count("bytes_read", len(data))
+        return data
+
+    async def _read_block(self, expected_bytes):
+        """Like transport.Transport._read_block: skips noise in front of the header and salvages the data"""
+        header = transport.BlockHeader(expected_bytes)
+        while not header.complete:
+            if header.lost:
+                header.feed((await self.reader.readuntil(b'#'))[-1:])
+            else:
+                header.feed(await self.reader.readexactly(1))
+        if header.length is None:
+            #indefinite length block, only terminated by the line end
+            return (await self.reader.readuntil(self.b_eol))[:-len(self.b_eol)]
+        data = await self.reader.readexactly(header.length)
+        try:
+            await asyncio.wait_for(self.reader.readuntil(self.b_eol), transport.SALVAGE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.metrics.count("salvaged")
+            self._dirty = True #the next command drops the rest of the answer
+        return data
+
+    async def query(self, msg, timeout=None):
+        await self.writeline(msg)
+        return await self.readline(timeout)
+
+    async def wait_ready(self, timeout=None):
+        """Wait until the oszi has finished all pending operations (*OPC? handshake)"""
+        answer = await self.query("*OPC?", timeout)
+        if synchronization._last_token(answer) != "1":
+            raise CommunicationException("Unexpected answer to *OPC?: "+repr(answer))
+
+    def close(self):
+        self.writer.close()
+
+
+class ExecutorComm:
+    """
+    Runs the calls of a blocking connection in a worker thread
+
+    Used for GPIBComm (VISA has no asyncio interface) and SimulatedTDS210. The calls
+    are executed one after the other in a single thread, so the connection is never
+    used concurrently. The timeout is passed to the connection and also enforced on
+    the event loop side. A read that is interrupted there still runs to its end in
+    the thread, afterwards the pending answers are dropped (con.clear()) before the
+    next call.
+    """
+
+    def __init__(self, con, executor=None, timeout=5):
+        self.con = con
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(1)
+        self.timeout = timeout
+        self._dirty = False
+
+    @classmethod
+    async def open(cls, factory, *args, **kwargs):
+        """Create the connection by factory(*args, **kwargs) in the worker thread"""
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+        loop = asyncio.get_event_loop()
+        con = await loop.run_in_executor(executor, functools.partial(factory, *args, **kwargs))
+        return cls(con, executor)
+
+    @property
+    def metrics(self):
+        return self.con.metrics
+
+    @metrics.setter
+    def metrics(self, value):
+        self.con.metrics = value
+
+    def _run(self, function, *args):
+        return asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(function, *args))
+
+    def _clear_if_dirty(self):
+        #runs in the worker thread, so it is executed after an interrupted read has finished
+        if self._dirty:
+            self._dirty = False
+            self.con.clear()
+
+    async def _call(self, function, *args):
+        await self._run(self._clear_if_dirty)
+        return await self._run(function, *args)
+
+    async def _read(self, function, timeout, *args):
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            return await _wait(self._call(function, *(args + (timeout,))), timeout, self.metrics)
+        except BaseException:
+            self._dirty = True
+            raise
+
+    def drop_pending(self):
+        """Drop the answers not read yet before the next call, e.g. after a cancelled query"""
+        self._dirty = True
+
+    async def clear(self):
+        self._dirty = True
+        await self._run(self._clear_if_dirty)
+
+    async def writeline(self, message):
+        await self._call(self.con.writeline, message)
+
+    async def readline(self, timeout=None):
+        return await self._read(self.con.readline, timeout)
+
+    async def read_block(self, expected_bytes=None, timeout=None):
+        return await self._read(self.con.read_block, timeout, expected_bytes)
+
+    async def query(self, msg, timeout=None):
+        await self.writeline(msg)
+        return await self.readline(timeout)
+
+    async def wait_ready(self, timeout=None):
+        await self._read(self.con.wait_ready, timeout)
+
+    def close(self):
+        self.con.close()
+        self.executor.shutdown(wait=False)
+
+
+async def open_connection(address, baudrate=9600, timeout=5, **options):
+    """Open the async connection for an address of scope.Scope (see transport.py)"""
+    if transport.find_backend(address) == "serial":
+        return await AsyncSerialComm.open(address, baudrate, timeout=timeout, eol='\r\n') #timeout in s
+    con = await ExecutorComm.open(transport.open_transport, address, baudrate, timeout, '\r\n', **options)
+    con.timeout = timeout
+    return con
+
+
+class AsyncScope(scope._ScopeBase):
+    """
+    Object modeling the oszilloscope, with coroutines instead of blocking calls
+
+    Create it with the coroutine AsyncScope.open(), which takes the arguments of
+    scope.Scope. Only one coroutine may use the scope at a time.
+    """
+
+    def __init__(self, con, timeout=5, debug=False, preamble_ttl=None, metrics=None):
+        scope._ScopeBase.__init__(self, timeout, debug, preamble_ttl, metrics)
+        self.con = con
+        self.con.metrics = self.metrics
+
+    @classmethod
+    async def open(cls, address, baudrate=9600, timeout=5, debug=False, preamble_ttl=None, metrics=None, **options):
+        con = await open_connection(address, baudrate, timeout, **options)
+        sc = cls(con, timeout, debug, preamble_ttl, metrics)
+        await sc._send(":ACQ:STATE 1") #set oszi non freezing
+        sc._shadow[":ACQ:STATE"] = "1"
+        await sc.wait_ready()
+        return sc
+
+    def close(self):
+        self.con.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    async def get_oszi_ID(self):
+        return await self.con.query("ID?")
+
+    async def wait_ready(self, timeout=None):
+        await self.con.wait_ready(self.timeout if timeout is None else timeout)
+
+    async def _send(self, *commands):
+        """Send all non empty commands in one line, returns False if there was nothing to send"""
+        line = ";".join(c for c in commands if c)
+        if not line:
+            return False
+        await self.con.writeline(line)
+        return True
+
+    async def unfreeze(self):
+        self._shadow[":ACQ:STATE"] = "1"
+        await self._send(":ACQ:STATE 1")
+
+    async def _restore(self):
+        """Unfreeze the oszi after an interrupted read"""
+        self._shadow.pop(":ACQ:STATE", None)
+        #shielded, so a second cancellation does not interrupt the unfreeze
+        await asyncio.shield(self.unfreeze())
+
+    async def _configure(self, settings):
+        if await self._send(self._changed_settings(settings)):
+            self.invalidate_preamble()
+            return True
+        return False
+
+    async def config_channel(self, channel=1, bandwidth=None,  coupling=None, position=None, scale=None, probe=None):
+        """Configure channel settings, see scope.Scope.config_channel"""
+        return await self._configure(self._channel_settings(channel, bandwidth, coupling, position, scale, probe))
+
+    async def config_time(self, position=0.0, scale=1.0):
+        return await self._configure(self._time_settings(position, scale))
+
+    async def config_trigger(self, mode=None, typ=None, coupling=None, slope=None, level=None):
+        return await self._configure(self._trigger_settings(mode, typ, coupling, slope, level))
+
+    async def get_channel_config(self, channel=1):
+        return scope._config_dict(self._read_back(await self.con.query(self._headed(":CH{:d}?".format(channel)))))
+
+    async def get_time_config(self):
+        return scope._config_dict(self._read_back(await self.con.query(self._headed(":HOR:MAI?"))))
+
+    async def get_trigger_config(self):
+        return scope._config_dict(self._read_back(await self.con.query(self._headed(":TRIG:MAI?"))))
+
+    async def get_settings(self):
+        """Read all channel, horizontal and trigger settings with a single query, see scope.Scope.get_settings"""
+        return collections.OrderedDict(self._read_back(await self.con.query(self._headed(scope.SETTINGS_QUERY))))
+
+    async def set_settings(self, settings, force=False):
+        """Apply settings returned by get_settings() with a single write, see scope.Scope.set_settings"""
+        if force:
+            for header in settings:
+                self._shadow.pop(header, None)
+        return await self._configure(list(settings.items()))
+
+    async def _read_channel(self, channel, byte_wid, window):
+        source = self._changed_settings([(":DAT:SOU", channel)])
+        params = self._cached_preamble(channel, byte_wid)
+        if params is None:
+            with self.metrics.phase("setup"):
+                await self._send(source)
+            source = ""
+            with self.metrics.phase("settle"):
+                await self.wait_ready() #the new source has to be selected before querying its preamble
+            with self.metrics.phase("preamble"):
+                params = self._store_preamble(channel, byte_wid, await self.con.query(scope.PREAMBLE_QUERY))
+
+        start, stop, stride = window
+        with self.metrics.phase("transfer"):
+            await self._send(source, ":CURV?") #request the curve data
+            raw = await self.con.read_block((stop - start + 1)*byte_wid)
+        with self.metrics.phase("decode"):
+            return params, waveform.decode_curve(raw, params, byte_wid, stride=stride)
+
+    async def readScope(self, channel="CH1", fast_mode=True, start=1, stop=None, stride=1, timeout=None):
+        """
+        Read the data from scope without changing settings, see scope.Scope.readScope
+
+        Keyword arguments:
+        timeout - deadline in sec for the whole read (default: None, only the timeouts
+                  of the single reads apply)
+
+        Returns the tuple (x, data) resp. (x, data1, data2)
+        """
+        channels = self._parse_channels(channel)
+        byte_wid = 1 if fast_mode else 2
+        window = self._record_window(start, stop, stride)
+        read = self._read_frame(channels, byte_wid, window)
+        if timeout is None:
+            return await read
+        return await _wait(read, timeout, self.metrics)
+
+    async def _read_frame(self, channels, byte_wid, window):
+        try:
+            #freeze the Oszi and setup the transfer in one line
+            with self.metrics.phase("setup"):
+                await self._send(self._changed_settings([(":ACQ:STATE", "0")] + self._transfer_settings(byte_wid, window)))
+            data = []
+            for channel in channels:
+                params, volts = await self._read_channel(channel, byte_wid, window)
+                data.append(volts)
+            with self.metrics.phase("setup"):
+                await self._send(self._changed_settings([(":ACQ:STATE", "1")]))
+        except BaseException:
+            #cancelled, timed out or failed: the shadow and the preamble might be wrong now,
+            #and a query might have been sent whose answer was not read
+            self.invalidate_state()
+            self.con.drop_pending()
+            try:
+                await self._restore()
+            except Exception:
+                pass #report the original error
+            raise
+        return (self._x_axis(params, window).copy(),) + tuple(data) #like scope.Scope.readScope
@@ -0,0 +1,187 @@
+"""
+Benchmarks for acquisition, decoding and config round trips
+
+All benchmarks run against the simulated oszi (see simulator.py), so no hardware
+is needed. For the acquisition and config benchmarks two times are reported:
+    link_time - the modeled time on the serial/GPIB link (what a real oszi would need)
+    wall_time - the time spent on the host (with --time-scale 0 only the python overhead)
+
+usage:
+python benchmark.py                             #print the results as JSON
+python benchmark.py -o results.json             #save the results
+python benchmark.py --compare old.json          #compare with results of an older version
+python benchmark.py --only decode --repeat 50   #run a part of the benchmarks
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import numpy as np
+
+import scope
+import waveform
+import captureFile
+
+def _median(values):
+    return float(np.median(values))
+
+def _scope(link, time_scale):
+    sc = scope.Scope("SIM::GPIB" if link == "gpib" else "SIM::COM", baudrate="auto" if link == "serial_auto" else 9600)
+    sc.con.time_scale = time_scale
+    return sc
+
+def _measure(sc, function, repeat):
+    """Call function repeat times, return the median link and wall time per call"""
+    link_times = []
+    wall_times = []
+    for i in range(repeat):
+        link0 = sc.con.link_time
+        t0 = timeit.default_timer()
+        function(i)
+        wall_times.append(timeit.default_timer() - t0)
+        link_times.append(sc.con.link_time - link0)
+    return {'link_time': _median(link_times), 'wall_time': _median(wall_times)}
+
+def bench_acquisition(repeat, time_scale):
+    results = {}
+    for link in ("serial", "serial_auto", "gpib"):
+        sc = _scope(link, time_scale)
+        for channel in ("CH1", "CH1CH2"):
+            for mode, fast in (("fast", True), ("normal", False)):
+                sc.readScope(channel, fast_mode=fast) #warm up the settings and the preamble cache
+                results["readScope/{:s}/{:s}/{:s}".format(link, channel, mode)] = _measure(
+                    sc, lambda i: sc.readScope(channel, fast_mode=fast), repeat)
+                results["readScope_uncached/{:s}/{:s}/{:s}".format(link, channel, mode)] = _measure(
+                    sc, lambda i: (sc.invalidate_state(), sc.readScope(channel, fast_mode=fast)), repeat)
+    return results
+
+def bench_decode(repeat, n_frames=1000):
+    results = {}
+    preamble = {'XINCR': 2e-6, 'XZERO': -2.5e-3, 'YMULT': 4e-2, 'YZERO': 0.0, 'YOFF': 0.0}
+    for byte_wid, name in ((1, "int8"), (2, "int16")):
+        raw = np.random.RandomState(0).randint(-100, 100, 2500).astype(waveform.SAMPLE_DTYPES[byte_wid]).tobytes()
+        out = np.empty(2500)
+        times = []
+        for i in range(repeat):
+            t0 = timeit.default_timer()
+            for n in range(n_frames):
+                waveform.decode_curve(raw, preamble, byte_wid, out=out)
+            times.append(timeit.default_timer() - t0)
+        results["decode/"+name] = {'frames_per_sec': n_frames/_median(times)}
+    return results
+
+def bench_config(repeat, time_scale):
+    results = {}
+    for link in ("serial", "gpib"):
+        sc = _scope(link, time_scale)
+        results["get_channel_config/"+link] = _measure(sc, lambda i: sc.get_channel_config(1), repeat)
+        results["get_time_config/"+link] = _measure(sc, lambda i: sc.get_time_config(), repeat)
+        results["get_trigger_config/"+link] = _measure(sc, lambda i: sc.get_trigger_config(), repeat)
+        results["get_settings/"+link] = _measure(sc, lambda i: sc.get_settings(), repeat)
+        #alternate the values, so every call has to send something
+        results["config_channel/"+link] = _measure(
+            sc, lambda i: sc.config_channel(1, scale=(0.5, 1.0)[i % 2], position=0.0, coupling="DC", probe=1), repeat)
+        results["config_time/"+link] = _measure(sc, lambda i: sc.config_time(position=0.0, scale=(1e-3, 5e-4)[i % 2]), repeat)
+        results["config_trigger/"+link] = _measure(
+            sc, lambda i: sc.config_trigger(mode="AUTO", slope=("RISE", "FALL")[i % 2], level=0.0), repeat)
+        #switch between two presets
+        presets = []
+        for scale in (0.5, 1.0):
+            sc.config_channel(1, scale=scale)
+            presets.append(sc.get_settings())
+        results["set_settings/"+link] = _measure(sc, lambda i: sc.set_settings(presets[i % 2]), repeat)
+    return results
+
+def bench_save(repeat):
+    results = {}
+    sc = _scope("gpib", 0)
+    batch = sc.read_batch(1, "CH1CH2")
+    x, y1, y2 = sc.readScope("CH1CH2")
+    tmp = tempfile.mkdtemp()
+    text_times = []
+    binary_times = []
+    for i in range(repeat):
+        t0 = timeit.default_timer()
+        np.savetxt(os.path.join(tmp, "CH1.txt"), np.vstack((x, y1)).T)
+        np.savetxt(os.path.join(tmp, "CH2.txt"), np.vstack((x, y2)).T)
+        text_times.append(timeit.default_timer() - t0)
+        t0 = timeit.default_timer()
+        with captureFile.CaptureWriter.for_batch(os.path.join(tmp, "capture.scp"), batch) as f:
+            f.append_batch(batch)
+        binary_times.append(timeit.default_timer() - t0)
+    text_bytes = os.path.getsize(os.path.join(tmp, "CH1.txt")) + os.path.getsize(os.path.join(tmp, "CH2.txt"))
+    binary_bytes = (os.path.getsize(os.path.join(tmp, "capture.scp")) - captureFile.HEADER_SIZE)//repeat
+    for name in os.listdir(tmp):
+        os.remove(os.path.join(tmp, name))
+    os.rmdir(tmp)
+    results["save/text"] = {'wall_time': _median(text_times), 'bytes_per_frame': text_bytes}
+    results["save/binary"] = {'wall_time': _median(binary_times), 'bytes_per_frame': binary_bytes}
+    return results
+
+BENCHMARKS = ("acquisition", "decode", "config", "save")
+
+def run(only=BENCHMARKS, repeat=5, time_scale=0):
+    results = {}
+    if "acquisition" in only:
+        results.update(bench_acquisition(repeat, time_scale))
+    if "decode" in only:
+        results.update(bench_decode(repeat))
+    if "config" in only:
+        results.update(bench_config(repeat, time_scale))
+    if "save" in only:
+        results.update(bench_save(repeat))
+    return results
+
+def metadata(repeat, time_scale):
+    try:
+        revision = subprocess.check_output(["git", "describe", "--always", "--dirty"],
+                                           cwd=os.path.dirname(os.path.abspath(__file__)),
+                                           stderr=subprocess.STDOUT).decode('ascii').strip()
+    except Exception:
+        revision = None
+    return {'revision': revision, 'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'repeat': repeat, 'time_scale': time_scale}
+
+def compare(old, new):
+    """Print the relative change of all values present in both results"""
+    for name in sorted(new['results']):
+        if name not in old['results']:
+            continue
+        for key, value in sorted(new['results'][name].items()):
+            before = old['results'][name].get(key)
+            if not before:
+                continue
+            print("{:45s} {:16s} {:12.4g} -> {:12.4g} ({:+.1f}%)".format(name, key, before, value, 100.0*(value/before - 1)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pyScopeTools benchmarks (against the simulated oszi)")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--time-scale", type=float, default=0,
+                        help="real time spent per modeled link time (default: 0, do not sleep)")
+    parser.add_argument("-o", "--output", help="write the JSON results to this file")
+    parser.add_argument("--compare", help="JSON results of an older run to compare with")
+    args = parser.parse_args(argv)
+
+    report = {'meta': metadata(args.repeat, args.time_scale),
+              'results': run(args.only, args.repeat, args.time_scale)}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    elif not args.output:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Binary capture file for raw oszi frames
+
+The file starts with a fixed header of HEADER_SIZE bytes, followed by fixed size
+records, one per frame:
+    timestamp - float64, host time of the frame
+    preamble  - float64 (channels, 5), in the order of waveform.PREAMBLE_KEYS
+    samples   - int8/int16 (channels, points), the raw samples (little endian)
+
+Frames can only be appended, so a crash while writing loses at most the last frame.
+The records are read back with np.memmap, so frame k can be accessed without reading
+the whole file:
+
+    with captureFile.CaptureWriter("log.scp", n_channels=2, n_points=2500) as f:
+        f.append_batch(myscope.read_batch(10, "CH1CH2"))
+
+    cap = captureFile.CaptureFile("log.scp")
+    volts = cap.batch()[k]
+"""
+
+import os
+import struct
+import numpy as np
+
+import waveform
+
+MAGIC = b"PYSCOPE\0"
+VERSION = 1
+HEADER_SIZE = 64
+_HEADER = struct.Struct("<8sHBBIII") #magic, version, byte_wid, n_channels, n_points, start, stride
+
+def record_dtype(n_channels, n_points, byte_wid=1):
+    """numpy dtype of one frame record"""
+    return np.dtype([('timestamp', '<f8'),
+                     ('preamble', '<f8', (n_channels, len(waveform.PREAMBLE_KEYS))),
+                     ('samples', waveform.SAMPLE_DTYPES[byte_wid].newbyteorder('<'), (n_channels, n_points))])
+
+def read_header(path):
+    """Return the header of a capture file as dict"""
+    with open(path, 'rb') as f:
+        data = f.read(HEADER_SIZE)
+    if len(data) < HEADER_SIZE or data[:len(MAGIC)] != MAGIC:
+        raise IOError("Not a capture file: "+path)
+    magic, version, byte_wid, n_channels, n_points, start, stride = _HEADER.unpack(data[:_HEADER.size])
+    if version != VERSION:
+        raise IOError("Unsupported capture file version {:d}".format(version))
+    return {'byte_wid': byte_wid, 'n_channels': n_channels, 'n_points': n_points, 'start': start, 'stride': stride}
+
+
+class CaptureWriter:
+    """
+    Append frames to a capture file
+
+    If the file already exists, its header has to match the given layout and the
+    frames are appended to the existing ones.
+    """
+
+    def __init__(self, path, n_channels, n_points, byte_wid=1, start=1, stride=1):
+        self.path = path
+        self.header = {'byte_wid': byte_wid, 'n_channels': n_channels, 'n_points': n_points, 'start': start, 'stride': stride}
+        self.dtype = record_dtype(n_channels, n_points, byte_wid)
+        self._record = np.zeros(1, dtype=self.dtype)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            if read_header(path) != self.header:
+                raise IOError("The layout of {:s} does not match: {:s}".format(path, str(read_header(path))))
+            self.f = open(path, 'r+b')
+            #drop an incomplete last record
+            n = (os.path.getsize(path) - HEADER_SIZE)//self.dtype.itemsize
+            self.f.truncate(HEADER_SIZE + n*self.dtype.itemsize)
+            self.f.seek(0, os.SEEK_END)
+        else:
+            self.f = open(path, 'wb')
+            header = _HEADER.pack(MAGIC, VERSION, byte_wid, n_channels, n_points, start, stride)
+            self.f.write(header + b"\0"*(HEADER_SIZE - len(header)))
+
+    @classmethod
+    def for_batch(cls, path, batch):
+        """Create a writer with the layout of a waveform.WaveformBatch"""
+        return cls(path, batch.n_channels, batch.n_points, batch.byte_wid, batch.start, batch.stride)
+
+    def append(self, samples, preambles, timestamp):
+        """Append one frame, the arguments are the same as for WaveformBatch.append"""
+        record = self._record[0]
+        record['timestamp'] = timestamp
+        for i in range(self.header['n_channels']):
+            record['preamble'][i] = [preambles[i][key] for key in waveform.PREAMBLE_KEYS]
+            record['samples'][i] = samples[i]
+        self.f.write(self._record.tobytes())
+
+    def append_batch(self, batch):
+        """Append all frames of a waveform.WaveformBatch"""
+        records = np.zeros(len(batch), dtype=self.dtype)
+        records['timestamp'] = batch.timestamps
+        records['preamble'] = batch.preambles
+        records['samples'] = batch.raw
+        self.f.write(records.tobytes())
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CaptureFile:
+    """
+    Read-only access to a capture file via np.memmap
+
+    frames - structured memmap with the fields timestamp, preamble and samples
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = read_header(path)
+        dtype = record_dtype(self.header['n_channels'], self.header['n_points'], self.header['byte_wid'])
+        n = (os.path.getsize(path) - HEADER_SIZE)//dtype.itemsize
+        if n > 0:
+            self.frames = np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(n,))
+        else:
+            self.frames = np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def batch(self):
+        """Return the frames as waveform.WaveformBatch, without reading them into memory"""
+        return waveform.WaveformBatch.from_arrays(self.frames['samples'], self.frames['preamble'], self.frames['timestamp'],
+                                                  self.header['byte_wid'], self.header['start'], self.header['stride'])
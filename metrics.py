@@ -0,0 +1,108 @@
+"""
+Timing instrumentation of the scope and the connections
+
+Pass a Metrics object to the scope to see where the time goes:
+
+    m = metrics.Metrics()
+    myscope = scope.Scope("COM1", metrics=m)
+    myscope.readScope("CH1CH2")
+    print(m.summary())
+
+Phases (durations in sec):
+    setup - sending the freeze and transfer settings
+    settle - waiting until the oszi is ready (*OPC?, status byte)
+    trigger - waiting for the trigger of a single sequence (acquire_on_trigger)
+    preamble - querying the waveform preamble
+    transfer - requesting and receiving the curve data
+    decode - converting the raw data into Volts
+
+Counters:
+    bytes_written, bytes_read - bytes on the link
+    poll_iterations - loop iterations while waiting for data or for the oszi
+    timeouts - timeouts hit
+    resyncs - resyncs of the link after a failed read (Scope.resync)
+    retries - reads repeated after a resync
+    salvaged - blocks used although their line end was missing
+
+Without a Metrics object, NULL_METRICS is used, which does nothing.
+"""
+
+import collections
+import timeit
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_PHASE = _NullPhase()
+
+
+class NullMetrics(object):
+    """Metrics that are not recorded"""
+    enabled = False
+
+    def phase(self, name):
+        return _NULL_PHASE
+
+    def count(self, name, value=1):
+        pass
+
+NULL_METRICS = NullMetrics()
+
+
+class _Phase(object):
+    __slots__ = ('metrics', 'name', 't0')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = timeit.default_timer()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.add_duration(self.name, timeit.default_timer() - self.t0)
+        return False
+
+
+class Metrics(object):
+    """
+    Collects the durations of the phases and the counters
+
+    Keyword arguments:
+    callback - called as callback(kind, name, value) for every finished phase
+               (kind "phase", value: duration in sec) and every count (kind "count")
+    """
+    enabled = True
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        self.durations = collections.defaultdict(float) #phase -> total duration
+        self.calls = collections.defaultdict(int)       #phase -> number of calls
+        self.counters = collections.defaultdict(int)
+
+    def phase(self, name):
+        """Context manager measuring the duration of a phase"""
+        return _Phase(self, name)
+
+    def add_duration(self, name, duration):
+        self.durations[name] += duration
+        self.calls[name] += 1
+        if self.callback is not None:
+            self.callback("phase", name, duration)
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+        if self.callback is not None:
+            self.callback("count", name, value)
+
+    def summary(self):
+        """Return the collected values as dict"""
+        return {'durations': dict(self.durations), 'calls': dict(self.calls), 'counters': dict(self.counters)}
@@ -0,0 +1,108 @@
+"""
+Synchronized acquisition from several oszis
+
+MultiScope reads all oszis in parallel, one thread per oszi, so a read takes about
+as long as the slowest single read instead of the sum of all reads. Before every
+frame the threads meet at a barrier and then freeze their oszi (ACQ:STATE 0) at
+the same time; everything else (transfer setup, preamble queries) is done before
+the barrier, so only the short freeze command lies between the barrier and the
+freeze.
+
+usage:
+    scopes = multiScope.MultiScope(["COM1", "COM2", u'GPIB0::1::INSTR'])
+    batch = scopes.read_batch(10, "CH1CH2")
+    volts = batch[scopes.frame_index(3, 1)]   #frame 3 of the second oszi
+    print(batch.timestamps, scopes.skew)
+"""
+
+from __future__ import print_function
+import concurrent.futures
+import threading
+
+import scope
+import waveform
+
+class MultiScope:
+    """
+    Acquire from several oszis in parallel
+
+    Arguments:
+    scopes - list of scope.Scope objects or addresses, the addresses are opened
+             in parallel with the keyword arguments of scope.Scope (baudrate, timeout, ...)
+    """
+
+    def __init__(self, scopes, **kwargs):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max(len(scopes), 1))
+        self.scopes = self._run([(lambda s=s: s if isinstance(s, scope.Scope) else scope.Scope(s, **kwargs))
+                                 for s in scopes])
+        self.skew = [] #per frame: time in sec between the first and the last freeze
+
+    def __len__(self):
+        return len(self.scopes)
+
+    def _run(self, functions):
+        """Call the functions in parallel, return their results or raise the error of a failed call"""
+        futures = [self._executor.submit(f) for f in functions]
+        concurrent.futures.wait(futures)
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        #a failed thread breaks the barrier of the others, so report the original error
+        errors.sort(key=lambda e: isinstance(e, threading.BrokenBarrierError))
+        if errors:
+            raise errors[0]
+        return [f.result() for f in futures]
+
+    def frame_index(self, frame, scope_index):
+        """Index in the batch of read_batch of the given frame of the given oszi"""
+        return frame*len(self.scopes) + scope_index
+
+    def _reader(self, sc, count, channels, byte_wid, window, barrier):
+        """Thread function: read count frames of one oszi, freezing it when all threads reached the barrier"""
+        frames = []
+        try:
+            sc._setup_transfer(byte_wid, window)
+            for n in range(count):
+                #get the preambles before the barrier, so only the freeze follows it
+                for channel in channels:
+                    if sc._cached_preamble(channel, byte_wid) is None:
+                        sc._send(sc._changed_settings([(":DAT:SOU", channel)]))
+                        sc._query_preamble(channel, byte_wid)
+                barrier.wait()
+                timestamp, x, curves = sc._retry(sc._acquire, channels, byte_wid, window, True)
+                frames.append((timestamp, curves))
+        except BaseException:
+            barrier.abort() #do not let the other threads wait for this one
+            raise
+        return frames
+
+    def read_batch(self, count=1, channel="CH1", fast_mode=True, start=1, stop=None, stride=1):
+        """
+        Read count frames of every oszi into one waveform.WaveformBatch
+
+        The frames are ordered by frame, then by oszi: frame n of oszi i has the index
+        n*len(scopes) + i (see frame_index). Each frame has the host timestamp of the
+        freeze of its oszi; the spread of the freezes of each frame is stored in skew.
+
+        Keyword arguments:
+        channel, fast_mode, start, stop, stride - see Scope.readScope, the same for all oszis
+        """
+        channels = self.scopes[0]._parse_channels(channel)
+        byte_wid = 1 if fast_mode else 2
+        window = self.scopes[0]._record_window(start, stop, stride)
+        timeout = max(sc.timeout for sc in self.scopes)
+        barrier = threading.Barrier(len(self.scopes), timeout=timeout*(len(channels) + 2))
+        results = self._run([(lambda sc=sc: self._reader(sc, count, channels, byte_wid, window, barrier))
+                             for sc in self.scopes])
+
+        batch = waveform.WaveformBatch(len(channels), self.scopes[0]._window_points(window), byte_wid,
+                                       capacity=max(count*len(self.scopes), 1), start=window[0], stride=window[2])
+        self.skew = []
+        for n in range(count):
+            timestamps = [frames[n][0] for frames in results]
+            self.skew.append(max(timestamps) - min(timestamps))
+            for sc, frames in zip(self.scopes, results):
+                timestamp, curves = frames[n]
+                sc._append_frame(batch, curves, timestamp)
+        return batch
+
+    def close(self):
+        self._executor.shutdown()
@@ -3,41 +3,141 @@ Small tool to quick download the current oszi graph and save it as png- & txt-fi
 
 usage:
 python quickScope.py COM1
+python quickScope.py GPIB0::1::INSTR --count 10 --interval 60  #10 shots, one per minute
+python quickScope.py COM1 --count 0 --interval 5 --no-png      #every 5sec until Ctrl+C, only txt
+
+To log the raw frames into a binary capture file instead (see captureFile.py),
+which is much faster and smaller than txt and png files:
+python quickScope.py COM1 --append log.scp --count 100
+
+The png files are rendered by a pool of worker processes with the Agg backend of
+matplotlib, so the acquisition never waits for the plotting; only before exiting the
+tool waits for the plots still pending. matplotlib is imported only by the workers and
+the driver of the connection only when it is opened, so the tool starts quickly
+(numpy is needed by every read, it is imported with the scope module).
 """
 
-import scope
-import sys
-import numpy as np
-import matplotlib.pyplot as plt
+import argparse
+import os
 import time
 
-args = sys.argv[1:]
-port = "COM1"
-if len(args)>0:
-    port = args[0]
-print("Reading scope using: "+port)
-
-sc = scope.Scope(port, baudrate=9600)
-time.sleep(0.5)
-
-#x, y1, y2 = sc.readScope("CH1Ch2")
-result = sc.readScope("CH1Ch2")
-x = result[0]
-y1 = result[1]
-y2 = None
-if len(result)==3 and result[2] is not None:
-    y2 = result[2]
-
-dataname = time.strftime("%x").replace('/','-')+"_"+time.strftime("%H-%M-%S")
-
-data1 = np.vstack((x,y1)).T
-np.savetxt("./"+dataname+"_CH1.txt", data1)
-if y2:
-    data2 = np.vstack((x,y2)).T
-    np.savetxt("./"+dataname+"_CH2.txt", data2)
-
-plt.plot(x, y1, "r-")
-if y2:
-    plt.plot(x, y2, 'b-')
-plt.savefig("./"+dataname+".png", dpi=600)
-#plt.show()
\ No newline at end of file
+def render_png(path, x, curves, dpi=600):
+    """Plot the curves over x into a png file (runs in a worker process)"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    for y, style in zip(curves, ("r-", "b-")):
+        ax.plot(x, y, style)
+    fig.savefig(path, dpi=dpi)
+    return path
+
+def _ignore_sigint():
+    #Ctrl+C stops the capture, the workers still finish the pending plots
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Save the current oszi graph as png- & txt-file")
+    parser.add_argument("address", nargs="?", default="COM1", help='address of the oszi, e.g. "COM1", "GPIB0::1::INSTR" (default: %(default)s)')
+    parser.add_argument("--baudrate", default="9600", help='serial baudrate or "auto" (default: %(default)s)')
+    parser.add_argument("--channel", default="CH1CH2", help='"CH1", "CH2" or "CH1CH2" (default: %(default)s)')
+    parser.add_argument("--normal", action="store_true", help="transfer 2 bytes per point instead of 1")
+    parser.add_argument("--count", type=int, default=1, help="number of shots, 0: until Ctrl+C (default: %(default)s)")
+    parser.add_argument("--interval", type=float, default=0, help="sec between the starts of the shots (default: as fast as possible)")
+    parser.add_argument("--outdir", default=".", help="directory of the txt and png files (default: %(default)s)")
+    parser.add_argument("--no-txt", dest="txt", action="store_false", help="do not save txt files")
+    parser.add_argument("--no-png", dest="png", action="store_false", help="do not render png files")
+    parser.add_argument("--dpi", type=int, default=600, help="resolution of the png files (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=2, help="processes rendering the png files (default: %(default)s)")
+    parser.add_argument("--append", metavar="PATH", help="append the raw frames to a capture file instead of saving txt/png")
+    args = parser.parse_args(argv)
+    if args.baudrate != "auto":
+        args.baudrate = int(args.baudrate)
+    return args
+
+def shots(count, interval):
+    """Yield the shot numbers, starting shot n at n*interval sec after the first one"""
+    t0 = time.time()
+    n = 0
+    while count == 0 or n < count:
+        delay = t0 + n*interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        yield n
+        n += 1
+
+def save_txt(path, x, y):
+    import numpy as np #already loaded by the scope module
+    np.savetxt(path, np.vstack((x, y)).T)
+
+def capture(sc, args):
+    import captureFile
+    writer = None
+    try:
+        for n in shots(args.count, args.interval):
+            batch = sc.read_batch(1, args.channel, fast_mode=not args.normal)
+            if writer is None:
+                writer = captureFile.CaptureWriter.for_batch(args.append, batch)
+            writer.append_batch(batch)
+            writer.flush()
+            print("Appended frame {:d} to {:s}".format(n, args.append))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if writer is not None:
+            writer.close()
+
+def save_shots(sc, args):
+    pool = None
+    pending = []
+    if args.png:
+        import concurrent.futures
+        import multiprocessing
+        #spawned workers do not inherit the open connection
+        pool = concurrent.futures.ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                      initializer=_ignore_sigint)
+    channels = sc._parse_channels(args.channel)
+    try:
+        for n in shots(args.count, args.interval):
+            result = sc.readScope(args.channel, fast_mode=not args.normal)
+            x, curves = result[0], result[1:]
+            dataname = time.strftime("%x").replace('/','-')+"_"+time.strftime("%H-%M-%S")
+            if args.count != 1:
+                dataname += "_{:04d}".format(n)
+            base = os.path.join(args.outdir, dataname)
+            if args.txt:
+                for channel, y in zip(channels, curves):
+                    save_txt(base+"_"+channel+".txt", x, y)
+            if pool is not None:
+                pending.append(pool.submit(render_png, base+".png", x, curves, args.dpi))
+                for f in [f for f in pending if f.done()]:
+                    f.result() #raise a failed rendering
+                    pending.remove(f)
+            print("Saved "+base)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pool is not None:
+            if not all(f.done() for f in pending):
+                print("Waiting for {:d} plot(s)".format(sum(not f.done() for f in pending)))
+            pool.shutdown(wait=True)
+            for f in pending:
+                f.result() #raise a failed rendering
+
+def main(argv=None):
+    args = parse_args(argv)
+    print("Reading scope using: "+args.address)
+    import scope
+    sc = scope.Scope(args.address, baudrate=args.baudrate) #returns when the oszi is ready
+    try:
+        if args.append:
+            capture(sc, args)
+        else:
+            save_shots(sc, args)
+    finally:
+        sc.con.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,230 @@
 from __future__ import print_function
+import collections
 import time
-import numpy as np
 import traceback
+import numpy as np
+
+from scopeExceptions import CommunicationException, InvalidArgumentException, TimeoutException
+import waveform
+import scpi
+import transport
+
+PREAMBLE_QUERY = "WFMPRe:XINCR?;XZERO?;YMULT?;YZERO?;YOFF?" #only request neccessary parameters (not complete WFMPRe?)
+SETTINGS_QUERY = ":CH1?;:CH2?;:HOR:MAI?;:TRIG:MAI?" #channel, horizontal and trigger settings in one answer
+RECOVERABLE_ERRORS = (CommunicationException, ValueError, EnvironmentError) #garbled numbers raise ValueError, the port EnvironmentError
+MAX_RETRY_DELAY = 1.0 #sec
+
+def _config_dict(items):
+    """Return the settings read back as dict keyed by the long form of the last mnemonic, e.g. {'SCALE': 1.0}"""
+    return dict((scpi.long_form(header.split(":")[-1]), scpi.number(value)) for header, value in items)
+
+
+class _ScopeBase(object):
+    """
+    State of the oszi that does not need the connection
+
+    Holds the shadow of the sent settings and the preamble cache, checks the
+    arguments and builds the commands. Scope and asyncScope.AsyncScope only add
+    the I/O on top of it.
+    """
+
+    RECORD_LENGTH = 2500 #number of data points of one channel
+
+    def __init__(self, timeout=5, debug=False, preamble_ttl=None, metrics=None):
+        self.debug = debug
+        self.timeout = timeout
+        if metrics is None:
+            import metrics as metrics_module
+            metrics = metrics_module.NULL_METRICS
+        self.metrics = metrics
+        self.preamble_ttl = preamble_ttl
+        self._preambles = {} #(channel, byte_wid) -> (preamble parameters, time of the query)
+        self._shadow = {} #command header -> value last sent to the oszi
+
+    def invalidate_preamble(self):
+        """Forget the cached waveform preambles, e.g. after the settings were changed on the front panel"""
+        self._preambles.clear()
+
+    def invalidate_state(self):
+        """
+        Forget which settings were sent to the oszi
+
+        Settings are only sent if they differ from the last sent value. Call this
+        after changing settings on the front panel or by writing to scope.con directly.
+        """
+        self._shadow.clear()
+        self.invalidate_preamble()
+
+    def _changed_settings(self, settings):
+        """
+        Build a command for the settings that differ from the values last sent
+
+        settings is a list of (header, value) tuples with full headers, e.g. (":DAT:WID", "1").
+        Consecutive settings of the same node are merged like ":DAT:ENC RIB;WID 1".
+        The shadow is updated, so the returned command has to be sent.
+        """
+        parts = []
+        node = None
+        for header, value in settings:
+            if scpi.same_value(self._shadow.get(header), value):
+                continue
+            self._shadow[header] = value
+            header_node, mnemonic = header.rsplit(":", 1)
+            if header_node == node:
+                parts.append(mnemonic+" "+value)
+            else:
+                parts.append(header+" "+value)
+            node = header_node
+        return ";".join(parts)
+
+    def _channel_settings(self, channel=1, bandwidth=None,  coupling=None, position=None, scale=None, probe=None):
+        """Check the arguments of config_channel and return them as list of settings"""
+        if channel not in (1, 2):
+            raise InvalidArgumentException("The channel must be 1 or 2")
+        if bandwidth and bandwidth not in ("ON", "OFF"):
+            raise InvalidArgumentException("The bandwidth must be 'OFF' (full, 60MHz) or 'ON' (20MHz)") 
+        if coupling and coupling not in ("DC", "AC", "GND"):
+            raise InvalidArgumentException("The coupling must be 'DC', 'AC' or 'GND'")
+        if (probe is not None) and probe not in (1, 10, 100, 1000):
+            raise InvalidArgumentException("The probe must be 1, 10, 100 or 1000")    
 
-class Scope:
+        node = ":CH{:d}:".format(channel)
+        settings = []
+        if probe is not None:
+            settings.append((node+"PRO", "{:d}".format(probe)))
+        if scale is not None:
+            settings.append((node+"SCA", "{:.2E}".format(scale)))
+        if position is not None:
+            settings.append((node+"POS", "{:.2E}".format(position)))
+        if coupling:
+            settings.append((node+"COUP", coupling))
+        if bandwidth:
+            settings.append((node+"BAN", bandwidth))
+        #self.con.writeline(":CH{:d}:PROBE {:d};SCALE {:.2E};POSITION {:.2E};COUPLING {:s};BANDWIDTH {:s}".format(channel, probe, scale, position, coupling, bandwidth))
+        return settings
+
+    def _time_settings(self, position=0.0, scale=1.0):
+        """Return the arguments of config_time as list of settings"""
+        settings = []
+        if position is not None:
+            settings.append((":HOR:MAI:POS", "{:.2E}".format(position)))
+        if scale is not None:
+            settings.append((":HOR:MAI:SCA", "{:.2E}".format(scale)))
+        #self.con.writeline(":HOR:POS {:.2E};SCA {:.2E}".format(position, scale))
+        return settings
+
+    def _trigger_settings(self, mode=None, typ=None, coupling=None, slope=None, level=None):
+        """Check the arguments of config_trigger and return them as list of settings"""
+        if mode and mode not in ("NORMAL", "AUTO"):
+            raise InvalidArgumentException("Mode must be 'NORMAL' or 'AUTO'")
+        if typ and typ not in ("EDGE", "VIDEO"):
+            raise InvalidArgumentException("Type must be 'EDGE' or 'VIDEO'")
+        if coupling and coupling not in ("AC", "DC", "NOISEREJ", "HFREJ", "NJREJ"):    
+            raise InvalidArgumentException("coupling must be 'AC', 'DC', 'NOISEREJ', 'HFREJ' or 'NJREJ'")
+        if slope and slope not in ("RISE", "FALL"):
+            raise InvalidArgumentException("slope must be 'RISE' or 'FALL'")
+
+        settings = []
+        if mode:
+            settings.append((":TRIG:MAI:MOD", mode))
+        if typ:
+            settings.append((":TRIG:MAI:TYP", typ))
+        if level is not None:
+            settings.append((":TRIG:MAI:LEV", "{:.2E}".format(level)))
+        if coupling:
+            settings.append((":TRIG:MAI:EDGE:COUP", coupling))
+        if slope:
+            settings.append((":TRIG:MAI:EDGE:SLO", slope))
+        return settings
+
+    def _headed(self, query):
+        """Prepend ":HEAD ON" to a query if the oszi might send its answers without headers"""
+        return ";".join(c for c in (self._changed_settings([(":HEAD", "ON")]), query) if c)
+
+    def _read_back(self, answer):
+        """
+        Parse the answer to a settings query into a list of (header, value)
+
+        The values are remembered as sent settings, so config_* and set_settings
+        only send what differs from them. A value that differs from the one sent
+        before was changed on the front panel, so the cached preambles are dropped.
+        """
+        items = [(":"+key, value) for key, value in scpi.parse_response(answer)]
+        for header, value in items:
+            old = self._shadow.get(header)
+            if old is not None and not scpi.same_value(old, value):
+                self.invalidate_preamble()
+            self._shadow[header] = value
+        return items
+
+    def _parse_channels(self, channel):
+        channels = [ch for ch in ("CH1", "CH2") if ch in channel]
+        if not channels:
+            raise InvalidArgumentException("No channels selected, use 'CH1', 'CH2' or 'CH1CH2'")
+        return channels
+
+    def _record_window(self, start=1, stop=None, stride=1):
+        """
+        Check the part of the record to be read and return it as (start, stop, stride)
+
+        start and stop are the first and last point (1..RECORD_LENGTH) that are transferred,
+        stride selects every n-th of these points.
+        """
+        if stop is None:
+            stop = self.RECORD_LENGTH
+        if not 1 <= start <= stop <= self.RECORD_LENGTH:
+            raise InvalidArgumentException("start and stop must fulfill 1 <= start <= stop <= {:d}".format(self.RECORD_LENGTH))
+        if stride < 1:
+            raise InvalidArgumentException("stride must be at least 1")
+        return (start, stop, stride)
+
+    def _window_points(self, window):
+        """Number of data points of a channel after applying the stride"""
+        start, stop, stride = window
+        return (stop - start)//stride + 1
+
+    def _transfer_settings(self, byte_wid, window):
+        """Header, encoding and start/stop settings needed before reading curves"""
+        start, stop, stride = window
+        return [(":HEAD", "ON"),
+                (":DAT:ENC", "RIB"),
+                (":DAT:WID", str(byte_wid)),
+                (":DAT:STAR", str(start)),
+                (":DAT:STOP", str(stop))]
+
+    def _x_axis(self, params, window, out=None):
+        """
+        Time axis of the transferred points (XZERO is the time of the first point of the record)
+
+        Without out, the cached read-only axis of waveform.x_axis is returned.
+        """
+        start, stop, stride = window
+        x = waveform.x_axis(params['XZERO'] + (start - 1)*params['XINCR'], stride*params['XINCR'], self._window_points(window))
+        if out is None:
+            return x
+        out[:] = x
+        return out
+
+    def _cached_preamble(self, channel, byte_wid):
+        """Return the cached preamble of the channel or None if it is not (or no longer) valid"""
+        cached = self._preambles.get((channel, byte_wid))
+        if cached is not None and (self.preamble_ttl is None or time.time() - cached[1] < self.preamble_ttl):
+            return cached[0]
+        return None
+
+    def _store_preamble(self, channel, byte_wid, answer):
+        """Parse the answer to PREAMBLE_QUERY and cache it"""
+        params = waveform.parse_preamble(answer)
+        if self.preamble_ttl != 0:
+            self._preambles[(channel, byte_wid)] = (params, time.time())
+        return params
+
+
+class Scope(_ScopeBase):
     """Object modeling the oszilloscope
 
     Working example:
 #####
-import numpy as np
 import matplotlib.pyplot as plt
 import scope
 
@@ -29,30 +245,45 @@ plt.show()
 #   normal mode: 0.55sec
 #   fast mode:   0.37sec
 
-    def __init__(self, address, baudrate=9600, timeout=5, debug = False):
+    def __init__(self, address, baudrate=9600, timeout=5, debug = False, preamble_ttl=None, metrics=None,
+                 retries=2, retry_delay=0.05, **options):
         """Create the scope object with given parameters
 
         Arguments:
         address - the com port to be used, eg "COM1"
                   or a GPIB address like "u'GPIB0::1::INSTR'"
                   the address is obtained by using GPIBConnection.list_devices()
+                  or "SIM::COM" / "SIM::GPIB" for a simulated oszi (see simulator.py)
+                  or "tcp://host:port" for a LAN-serial/LAN-GPIB server passing the bytes through
+                  or "/dev/usbtmc0" for the USBTMC driver of Linux
+                  (see transport.py for the address types and how to add one)
 
         Keyword arguments:
         baudrate - serial baudrate that is used (default: 9600)
+                   "auto" finds the baudrate of the oszi and raises it to the fastest one that
+                   works, with hardware flow control (see SerialComm.negotiate_baudrate)
         timeout - set the timeout. NOTICE: a serial connection needs a long timeout, so the default value is 6sec!
         debug - switch the command line output
+        preamble_ttl - the waveform preamble (scaling) of each channel is cached and only queried
+                       again after config_* was called. Changes on the front panel are not noticed,
+                       so either call invalidate_preamble() after touching the scope or give a
+                       maximum age of the cache in sec. 0 disables the cache. (default: None, no limit)
+        metrics - a metrics.Metrics object to record the duration of the phases of a read and
+                  the traffic of the connection (default: None, nothing is recorded)
+        retries - number of times a failed read is repeated after resyncing the link (default: 2)
+        retry_delay - sec to wait before the first retry, doubled for every further one (default: 0.05)
+        further keyword arguments are passed to the connection, e.g. chunk_size for VISA
+        and the socket backend
         """
-        if "COM" in address:
-            import serialConnection
-            self.con = serialConnection.SerialComm(address, baudrate, timeout=timeout, eol='\r\n') #timeout in s
-        elif "GPIB" in address:
-            import GPIBConnection
-            self.con = GPIBConnection.GPIBComm(address, timeout=timeout*1000, eol='\r\n')          #timeout in ms
-        else:
-            print("No valid address type")
-        self.debug = debug
+        self.con = transport.open_transport(address, baudrate, timeout, '\r\n', **options)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        _ScopeBase.__init__(self, timeout, debug, preamble_ttl, metrics)
+        self.con.metrics = self.metrics
 
-        self.con.writeline("ACQ:STATE 1") #set oszi non freezing
+        self._send(":ACQ:STATE 1") #set oszi non freezing
+        self._shadow[":ACQ:STATE"] = "1"
+        self.wait_ready()
         
     def get_oszi_ID(self):
         """
@@ -61,8 +292,32 @@ plt.show()
         result = self.con.query("ID?")
         return result
 
+    def wait_ready(self, timeout=None):
+        """
+        Block until the oszi has processed all previous commands
+
+        Uses the *OPC? handshake on serial connections and serial polls of the status
+        byte on GPIB. Raises a TimeoutException after timeout sec (default: the timeout
+        of the scope).
+        """
+        self.con.wait_ready(self.timeout if timeout is None else timeout)
+
+    def _send(self, *commands):
+        """Send all non empty commands in one line, returns False if there was nothing to send"""
+        line = ";".join(c for c in commands if c)
+        if not line:
+            return False
+        self.con.writeline(line)
+        return True
+
+    def _set_acq_state(self, state):
+        """Freeze ("0") or unfreeze ("1") the oszi"""
+        with self.metrics.phase("setup"):
+            self._send(self._changed_settings([(":ACQ:STATE", state)]))
+
     def unfreeze(self):
-        self.con.writeline("ACQ:STATE 1")    
+        self._shadow.pop(":ACQ:STATE", None) #send it in any case
+        self._set_acq_state("1")
         
     def config_channel(self, channel=1, bandwidth=None,  coupling=None, position=None, scale=None, probe=None): #enable, scale, x-position?
         """
@@ -91,258 +346,395 @@ plt.show()
         Returns
         -------
         bool
-            False if no configuration needed to be sent (because all arguments were None), otherwise True     
+            False if no configuration needed to be sent (because all arguments were None or the oszi
+            already has these settings), otherwise True
         """
-        if channel not in (1, 2):
-            raise InvalidArgumentException("The channel must be 1 or 2")
-        if bandwidth and bandwidth not in ("ON", "OFF"):
-            raise InvalidArgumentException("The bandwidth must be 'OFF' (full, 60MHz) or 'ON' (20MHz)") 
-        if coupling and coupling not in ("DC", "AC", "GND"):
-            raise InvalidArgumentException("The coupling must be 'DC', 'AC' or 'GND'")
-        if (probe is not None) and probe not in (1, 10, 100, 1000):
-            raise InvalidArgumentException("The probe must be 1, 10, 100 or 1000")    
-
-        command = ":CH{:d}:".format(channel)
-        if probe is not None:
-            command += "PRO {:d};".format(probe)
-        if scale is not None:
-            command += "SCA {:.2E};".format(scale)
-        if position is not None:
-            command += "POS {:.2E};".format(position)
-        if coupling:
-            command += "COUP "+coupling+";"
-        if bandwidth:
-            command += "BAN "+bandwidth+";"
-        command = command[:-1] #crop trailing ';'                    
-        #self.con.writeline(":CH{:d}:PROBE {:d};SCALE {:.2E};POSITION {:.2E};COUPLING {:s};BANDWIDTH {:s}".format(channel, probe, scale, position, coupling, bandwidth))
-        if len(command) > 6:
-            self.con.writeline(command)
+        settings = self._channel_settings(channel, bandwidth, coupling, position, scale, probe)
+        if self._send(self._changed_settings(settings)):
+            self.invalidate_preamble()
             return True
-        return False    
+        return False
 
     def get_channel_config(self, channel=1):
-        result = self.con.query("CH"+str(channel)+"?")
-        result = result[5:-1] #crop leading ":CH1:" and trailing "\n"
-        split = result.split(';')
-        result = {}
-        for s in split:
-            ss = s.split()
-            result[ss[0]] = ss[1]    
-        result['POSITION'] = eval(result['POSITION']) #convert to float
-        result['SCALE'] = eval(result['SCALE'])
-        result['PROBE'] = eval(result['PROBE'])    
-        return result
+        """Return the settings of a channel, e.g. {'PROBE': 1, 'SCALE': 1.0, 'POSITION': 0.0, 'COUPLING': 'DC', 'BANDWIDTH': 'OFF'}"""
+        return _config_dict(self._read_back(self.con.query(self._headed(":CH{:d}?".format(channel)))))
     
     def get_time_config(self):
-        result = self.con.query("HOR:MAI?")
-        print("result = "+result)
-        result = result[17:-1] #crop leading :HORIZONTAL:MAIN: & trailing \n
-        print("result = "+result)
-        split = result.split(";")
-        print("split = "+str(split))
-        result = {}
-        for s in split:
-            print("read: "+s)
-            ss = s.split()
-            result[ss[0]] = ss[1]
-        result['SCALE'] = eval(result['SCALE'])
-        result['POSITION'] = eval(result['POSITION'])
-
-        return result
+        """Return the horizontal settings, e.g. {'SCALE': 0.0005, 'POSITION': 0.0}"""
+        return _config_dict(self._read_back(self.con.query(self._headed(":HOR:MAI?"))))
 
     def config_time(self, position=0.0, scale=1.0):
-        command  = ":HOR:"
-        if position is not None:
-            command += "POS {:.2E};".format(position)
-        if scale is not None:
-            command += "SCA {:.2E};".format(scale)
-        command = command[:-1] #crop trailing ';'        
-        #self.con.writeline(":HOR:POS {:.2E};SCA {:.2E}".format(position, scale))
-        if len(command) > 6:
-            self.con.writeline(command)
+        settings = self._time_settings(position, scale)
+        if self._send(self._changed_settings(settings)):
+            self.invalidate_preamble()
             return True
-        return False    
+        return False
         
     def get_trigger_config(self):
-        result = self.con.query(":TRIG:MAI?")
-        result = result[:-1] #crop trailing \n
-        split = result.split(";")
-        result = {}
-        for s in split:
-            ss = s.split()
-            if "MODE" in ss[0]:
-                result['MODE'] = ss[1] #NORMAL, AUTO
-            if "TYPE" in ss[0]:
-                result['TYPE'] = ss[1] #EDGE, (VIDEO)
-            if "COUPLING" in ss[0]:
-                result['COUPLING'] = ss[1] #DC, NOISEREJ, HFREJ, LFREJ, AC
-            if "SLOPE" in ss[0]:
-                result['SLOPE'] = ss[1] #RISE, FALL
-            if "LEVEL" in ss[0]:    
-                result['LEVEL'] = ss[1]
+        """Return the trigger settings, e.g. {'MODE': 'AUTO', 'TYPE': 'EDGE', 'LEVEL': 0.0, 'COUPLING': 'DC', 'SLOPE': 'RISE', ...}"""
+        return _config_dict(self._read_back(self.con.query(self._headed(":TRIG:MAI?"))))
 
-        return result
+    def get_settings(self):
+        """
+        Read all channel, horizontal and trigger settings with a single query
+
+        Returns an OrderedDict header -> value as sent by the oszi, e.g. {":CH1:SCA": "1.0E0", ...},
+        which can be stored and given to set_settings() later.
+        """
+        return collections.OrderedDict(self._read_back(self.con.query(self._headed(SETTINGS_QUERY))))
+
+    def set_settings(self, settings, force=False):
+        """
+        Apply settings returned by get_settings() with a single write
+
+        Only the settings that differ from the values last sent or read are sent,
+        force=True sends all of them (e.g. after the front panel was used).
+        Returns False if nothing had to be sent.
+        """
+        if force:
+            for header in settings:
+                self._shadow.pop(header, None)
+        if self._send(self._changed_settings(list(settings.items()))):
+            self.invalidate_preamble()
+            return True
+        return False
     
     def config_trigger(self, mode=None, typ=None, coupling=None, slope=None, level=None):
-        if mode and mode not in ("NORMAL", "AUTO"):
-            raise InvalidArgumentException("Mode must be 'NORMAL' or 'AUTO'")
-        if typ and typ not in ("EDGE", "VIDEO"):
-            raise InvalidArgumentException("Type must be 'EDGE' or 'VIDEO'")
-        if coupling and coupling not in ("AC", "DC", "NOISEREJ", "HFREJ", "NJREJ"):    
-            raise InvalidArgumentException("coupling must be 'AC', 'DC', 'NOISEREJ', 'HFREJ' or 'NJREJ'")
-        if slope and slope not in ("RISE", "FALL"):
-            raise InvalidArgumentException("slope must be 'RISE' or 'FALL'")
-
-        command = ""
-        if mode or typ or (level is not None):
-            command = ":TRIG:MAI:"
-            if mode:
-                command += "MOD "+mode+";"
-            if typ:
-                command += "TYP "+typ+";"
-            if level is not None:
-                command += "LEV {:.2E};".format(level)
-
-        if coupling or slope:
-            command += ":TRIG:MAI:EDGE:"
-            if coupling:
-                command += "COUP "+coupling+";"
-            if slope:
-                command += "SLO "+slope +";"
-        command = command[:-1] #crop trailing ';'
-
-        if len(command) > 11:
-            self.con.writeline(command)
+        settings = self._trigger_settings(mode, typ, coupling, slope, level)
+        if self._send(self._changed_settings(settings)):
+            self.invalidate_preamble()
             return True
-        return False    
+        return False
+
+    def _setup_transfer(self, byte_wid, window):
+        """Send the transfer settings that are not set on the oszi yet"""
+        if self.debug: print("setup encoding, start & end value")
+        with self.metrics.phase("setup"):
+            self._send(self._changed_settings(self._transfer_settings(byte_wid, window)))
+
+    def _acquire(self, channels, byte_wid, window, raw=False, data_out=None, x_out=None):
+        """
+        Freeze the oszi, read all channels and unfreeze it.
+
+        The transfer settings that are not set yet (e.g. after a resync) are sent in
+        the same line as the freeze.
+
+        Keyword arguments:
+        raw - return the undecoded curves instead of Volts
+        data_out, x_out - preallocated arrays (channels, points) and (points,) for the
+                          curves in Volts and the time axis (default: new arrays)
+
+        Returns the host timestamp of the freeze, the time axis (None if raw) and the
+        list of the curves: arrays in Volts resp. (preamble, raw bytes) if raw.
+        """
+        if self.debug: print("freeze oszi, setup encoding, start & end value")
+        with self.metrics.phase("setup"):
+            self._send(self._changed_settings([(":ACQ:STATE", "0")] + self._transfer_settings(byte_wid, window)))
+        timestamp = time.time()
+        try:
+            curves = []
+            for i, channel in enumerate(channels):
+                if raw:
+                    curves.append(self._read_channel_raw(channel, byte_wid, window))
+                else:
+                    params, volts = self._read_channel(channel, byte_wid, window, out=None if data_out is None else data_out[i])
+                    curves.append(volts)
+        finally:
+            if self.debug: print("unfreeze oszi")
+            self._set_acq_state("1")
+        x = None if raw else self._x_axis(params, window, out=x_out)
+        return timestamp, x, curves
+
+    def read_batch(self, count, channel="CH1", fast_mode=True, start=1, stop=None, stride=1, batch=None):
+        """
+        Read count frames and store the raw samples in a waveform.WaveformBatch
+
+        The samples are kept as int8 (fast_mode) or int16 and only converted to Volts
+        when they are accessed, see waveform.WaveformBatch.
+
+        Keyword arguments:
+        channel, fast_mode, start, stop, stride - see readScope
+        batch - append the frames to this batch instead of creating a new one, it has
+                to be created with the same channels, data width and window
+
+        Returns the batch
+        """
+        channels = self._parse_channels(channel)
+        byte_wid = 1 if fast_mode else 2
+        window = self._record_window(start, stop, stride)
+        if batch is None:
+            batch = waveform.WaveformBatch(len(channels), self._window_points(window), byte_wid,
+                                           capacity=max(count, 1), start=window[0], stride=window[2])
+        for n in range(count):
+            timestamp, x, curves = self._retry(self._acquire, channels, byte_wid, window, True)
+            self._append_frame(batch, curves, timestamp)
+        return batch
+
+    def _append_frame(self, batch, curves, timestamp):
+        """Append the raw curves returned by _acquire to a waveform.WaveformBatch"""
+        with self.metrics.phase("decode"):
+            batch.append([waveform.decode_samples(raw, batch.byte_wid)[::batch.stride] for params, raw in curves],
+                         [params for params, raw in curves], timestamp)
+
+    def stream(self, channel="CH1", count=None, fast_mode=True, buffer_size=4, start=1, stop=None, stride=1):
+        """
+        Read frames back to back (generator)
+
+        The transfer setup is sent only once, afterwards every frame costs only the
+        freeze, the curve transfers and the unfreeze. The data is decoded into a ring of
+        buffer_size preallocated frames, so the arrays of a yielded acquisition.Frame are
+        only valid until buffer_size-1 further frames have been read. Copy them if they
+        are needed longer.
+        The consumer controls the pace, so no frames are dropped. To acquire in the
+        background, use start_stream().
+
+        Keyword arguments:
+        channel - channel to be read (default: "CH1"), also possible "CH1CH2"
+        count - number of frames to read (default: None, endless)
+        fast_mode - use 1byte vs 2bytes per data point
+        buffer_size - number of preallocated frames
+        start, stop, stride - part of the record to be read, see readScope
+        """
+        import acquisition
+        channels = self._parse_channels(channel)
+        byte_wid = 1 if fast_mode else 2
+        window = self._record_window(start, stop, stride)
+        ring = acquisition.FrameRingBuffer(buffer_size, len(channels), self._window_points(window))
+        n = 0
+        while count is None or n < count:
+            slot = ring.claim()
+            timestamp, x, data = self._retry(self._acquire, channels, byte_wid, window, False, ring.data[slot], ring.x[slot])
+            ring.publish(slot, timestamp)
+            yield ring.get()
+            n += 1
 
-    def readScope(self, channel="CH1", fast_mode=True):
+    def start_stream(self, channel="CH1", fast_mode=True, buffer_size=8, overwrite=True, start=1, stop=None, stride=1):
+        """
+        Start reading frames back to back in a background thread
+
+        Returns the running acquisition.AcquisitionThread, use its get() method to
+        receive the frames and stop() to end the acquisition. If the consumer is
+        slower than the oszi, the oldest frames are overwritten and reported in
+        Frame.dropped (overwrite=True), or the acquisition waits for the consumer
+        (overwrite=False, the waiting time is summed up in ring.blocked_time).
+        Do not use the scope object from another thread while the stream is running.
+        """
+        import acquisition
+        thread = acquisition.AcquisitionThread(self, channel, fast_mode, buffer_size, overwrite,
+                                               self._record_window(start, stop, stride))
+        thread.start()
+        return thread
+
+    def _arm(self):
+        """Start a single sequence acquisition, the oszi stops by itself after the next trigger"""
+        self._shadow.pop(":ACQ:STATE", None) #the oszi changes the state on its own
+        with self.metrics.phase("setup"):
+            self._send(self._changed_settings([(":ACQ:STOPA", "SEQ"), (":ACQ:STATE", "1")]))
+
+    def _wait_trigger(self, timeout):
+        """Wait until the armed sequence is complete, returns the host time of the completion"""
+        try:
+            with self.metrics.phase("trigger"):
+                self.con.wait_acquisition(timeout)
+        except TimeoutException:
+            self._set_acq_state("0") #disarm
+            raise TimeoutException("No trigger within {:.2f}sec".format(timeout))
+        self._shadow[":ACQ:STATE"] = "0"
+        return time.time()
+
+    def _end_sequence(self):
+        """Back to continuous acquisition"""
+        self._shadow.pop(":ACQ:STATE", None)
+        with self.metrics.phase("setup"):
+            self._send(self._changed_settings([(":ACQ:STOPA", "RUNST"), (":ACQ:STATE", "1")]))
+
+    def acquire_on_trigger(self, timeout=None, channel="CH1", fast_mode=True, start=1, stop=None, stride=1):
+        """
+        Arm a single sequence and read the frame of the next trigger event
+
+        Instead of freezing whatever is on the screen, the oszi acquires once after the
+        trigger (set up with config_trigger) and stops. Waiting costs only serial polls
+        of the status byte on GPIB resp. "ACQ:STATE?" queries with growing intervals on
+        serial, and only the triggered frame is transferred. Afterwards the oszi runs
+        continuously again.
+        Raises a TimeoutException if there was no trigger within timeout sec
+        (default: the timeout of the scope).
+
+        Keyword arguments:
+        channel, fast_mode, start, stop, stride - see readScope
+
+        Returns the tuple (x, data) resp. (x, data1, data2) like readScope
+        """
+        channels = self._parse_channels(channel)
+        byte_wid = 1 if fast_mode else 2
+        window = self._record_window(start, stop, stride)
+        self._setup_transfer(byte_wid, window)
+        self._arm()
+        try:
+            self._wait_trigger(self.timeout if timeout is None else timeout)
+            data = []
+            for ch in channels:
+                params, volts = self._read_channel(ch, byte_wid, window)
+                data.append(volts)
+        finally:
+            self._end_sequence()
+        return (self._x_axis(params, window).copy(),) + tuple(data)
+
+    def trigger_loop(self, count=None, duration=None, timeout=None, channel="CH1", fast_mode=True, transfer=True,
+                     start=1, stop=None, stride=1):
+        """
+        Arm single sequences again and again and yield every trigger event (generator)
+
+        The oszi stays in single sequence mode until the loop ends, for every event an
+        acquisition.Frame is yielded. With transfer=False the curves are not read and
+        x and data of the frames are None, which allows to count events quickly:
+
+            n = sum(1 for frame in myscope.trigger_loop(duration=60, transfer=False))
+
+        Keyword arguments:
+        count - stop after this number of events (default: None, no limit)
+        duration - stop after this time in sec without raising an exception (default: None, no limit)
+        timeout - maximum time in sec to wait for a single event, then a TimeoutException is
+                  raised (default: the timeout of the scope, without limit if a duration is given)
+        channel, fast_mode, start, stop, stride - see readScope
+        """
+        import acquisition
+        channels = self._parse_channels(channel)
+        byte_wid = 1 if fast_mode else 2
+        window = self._record_window(start, stop, stride)
+        if timeout is None and duration is None:
+            timeout = self.timeout
+        if transfer:
+            self._setup_transfer(byte_wid, window)
+        t_end = None if duration is None else time.time() + duration
+        n = 0
+        try:
+            while count is None or n < count:
+                wait = timeout
+                if t_end is not None:
+                    remaining = t_end - time.time()
+                    if remaining <= 0:
+                        return
+                    wait = remaining if timeout is None else min(timeout, remaining)
+                self._arm()
+                try:
+                    timestamp = self._wait_trigger(wait)
+                except TimeoutException:
+                    if t_end is not None and time.time() >= t_end:
+                        return #the duration is over
+                    raise
+                x = data = None
+                if transfer:
+                    data = np.empty((len(channels), self._window_points(window)))
+                    for i, ch in enumerate(channels):
+                        params, volts = self._read_channel(ch, byte_wid, window, out=data[i])
+                    x = self._x_axis(params, window).copy()
+                yield acquisition.Frame(n, timestamp, x, data, 0)
+                n += 1
+        finally:
+            self._end_sequence()
+
+    def _read_channel(self, channel, byte_wid, window, out=None):
+        """
+        Read the preamble and the curve of a single channel.
+
+        The encoding, width and start/stop point have to be set up already.
+        Returns the preamble parameters and the data in Volts. If out is given,
+        the data is written into this array instead of a new one.
+        """
+        params, raw = self._read_channel_raw(channel, byte_wid, window)
+        with self.metrics.phase("decode"):
+            return params, waveform.decode_curve(raw, params, byte_wid, out=out, stride=window[2])
+
+    def _read_channel_raw(self, channel, byte_wid, window):
+        """Like _read_channel, but returns the undecoded data bytes of the curve"""
+        if self.debug: print("request "+channel)
+        source = self._changed_settings([(":DAT:SOU", channel)])
+        params = self._cached_preamble(channel, byte_wid)
+        if params is None:
+            with self.metrics.phase("setup"):
+                self._send(source)
+            source = ""
+            params = self._query_preamble(channel, byte_wid)
+
+        start, stop, stride = window
+        with self.metrics.phase("transfer"):
+            self._send(source, ":CURV?") #request the curve data
+            #the block header tells the exact number of bytes, so a \r\n inside the data does not matter
+            return params, self.con.read_block((stop - start + 1)*byte_wid)
+
+    def _query_preamble(self, channel, byte_wid):
+        """Query the preamble of the selected source channel and cache it"""
+        with self.metrics.phase("settle"):
+            self.wait_ready() #the new source has to be selected before querying its preamble
+        with self.metrics.phase("preamble"):
+            answer = self.con.query(PREAMBLE_QUERY)
+        #maybe also request XUNIT and YUNIT? but it seems to be always sec and Volts
+        return self._store_preamble(channel, byte_wid, answer)
+
+    def readScope(self, channel="CH1", fast_mode=True, start=1, stop=None, stride=1):
         """
         Read the data from scope without changing settings
 
+        If the read fails (timeout, garbled answer), the link is resynced and the read
+        is repeated, see resync() and the retries argument of Scope.
+
         Keyword arguments:
         channel - channel to be read (default: "CH1"), also possible "CH1CH2"
         fast_mode - use 1byte vs 2bytes per data point
+        start - first point of the record to be transferred (default: 1)
+        stop - last point of the record to be transferred (default: None, the whole record: 2500)
+               only the points start..stop are sent by the oszi, so a small window
+               reduces the transfer time accordingly
+        stride - keep only every stride-th of the transferred points (default: 1)
+                 the TDS200 series can not decimate, so this is done on the host and
+                 does not reduce the transfer time
         """
         #logger.info("now read scope")
         byte_wid = 1 if fast_mode else 2
-        read_ch1 = "CH1" in channel
-        read_ch2 = "CH2" in channel
-        if not read_ch1 and not read_ch2:
+        window = self._record_window(start, stop, stride)
+        if "CH1" not in channel and "CH2" not in channel:
             print("No channels selected.")
             return
-        # catch possible exceptions
-        try:
-            t0 = time.time()
-            self.con.writeline("HEAD ON")
-            #freeze the Oszi
-            if self.debug: print("freeze oszi")
-            self.con.writeline("ACQ:STATE 0")
-            #setup encoding
-            if self.debug: print("setup encoding")
-            self.con.writeline("DAT:ENC RIB")
-            self.con.writeline("DAT:WID "+str(byte_wid))
-            #setup start and endpoint
-            if self.debug: print("setup start & end value")
-            self.con.writeline("DAT:STAR 1")
-            self.con.writeline("DAT:STOP 2500")
-            #now read CH1
-            if read_ch1:
-                if self.debug: print("request CH1")
-                self.con.writeline("DAT:SOU CH1")
-                time.sleep(0.5)
-                out = self.con.query("WFMPRe:XINCR?;XZERO?;YMULT?;YZERO?;YOFF?") #only request neccessary parameters (not complete WFMPRe?)
-                #maybe also request XUNIT and YUNIT? but it seems to be always sec and Volts
-                params = {}
-                out = out.split(';')
-                for s in out:
-                     d = s.split(" ") #now split on the space sign
-                     params[d[0][8:]] = d[1]
-
-                self.con.writeline("CURV?") #request the curve data  
-                out = self.con.readline_raw(2500 if byte_wid==1 else 5000)
-                out = out[13:-1] #drop the first 13 chars: ":CURVE #45000" and the last '\n'
-                #so now out contains only the bytes of the curve data
-                
-                if byte_wid == 1:
-                    if len(out) > 2500: #should not happen
-                        out = out[:2500]
-                        print("1: must drop one")
-                    data1 = np.fromstring(out, dtype='b')
-                else:
-                    if len(out) > 5000: #should not happen
-                        out = out[:5000]
-                        print("2: must drop one")
-                    data1 = np.fromstring(out, dtype='>i2')
-                    
-                # add y-offset to data
-                data1 = np.add(data1,np.ones(data1.shape)*(-float(params['YOFF'])))
-                # multiply value to get the actual voltage
-                data1 *= float(params['YMULT'])
-            #now read CH2    
-            if read_ch2:            
-                if self.debug: print("request CH2")
-                self.con.writeline("DAT:SOU CH2")
-                time.sleep(0.5)
-                out = self.con.query("WFMPRe:XINCR?;XZERO?;YMULT?;YZERO?;YOFF?") #only request neccessary parameters (not complete WFMPRe?)
-                #maybe also request XUNIT and YUNIT? but it seems to be always sec and Volts
-                
-                params = {}
-                out = out.split(';')
-                for s in out:
-                     d = s.split(" ") #now split on the space sign
-                     params[d[0][8:]] = d[1]
-
-                self.con.writeline("CURV?") #request the curve data
-                out = self.con.readline_raw(2500 if byte_wid==1 else 5000)
-                out = out[13:-1]                
-                
-                if byte_wid == 1:
-                    if len(out) > 2500:
-                        out = out[:2500]
-                        print("1: must drop one")
-                    data2 = np.fromstring(out, dtype='b')
-                else:
-                    if len(out) > 5000:
-                        out = out[:5000] #drop another char  (only neccessary when using serial connection COM port)??
-                        print("2: must drop one")
-                    data2 = np.fromstring(out, dtype='>i2')
-                    
-                # add offset to data
-                data2 = np.add(data2,np.ones(data2.shape)*(-float(params['YOFF'])))
-                # multiply to get voltage
-                data2 *= float(params['YMULT'])
-    
-            # create x axis
-            x = np.arange(float(params['XZERO']),
-                            float(params['XZERO'])+2500*float(params['XINCR']),
-                            float(params['XINCR']))    
-                            
-            
-            
-            #finally unfreeze the Oszi
-            if self.debug: print("unfreeze oszi")
-            self.con.writeline("ACQ:STATE 1")
-            if self.debug: print("done")
-            if self.debug:
-                print("Reading took: "+str(time.time() - t0)+"sec")    
-            if read_ch1 and read_ch2:
-                return x, data1, data2
-            if read_ch1:
-                return x, data1
-            if read_ch2:
-                return x, data2
-            else:
-                return (0,0)
-             
-        except:
-            # error in read
-            traceback.print_exc()
-            raise
+        t0 = time.time()
+        timestamp, x, data = self._retry(self._acquire, self._parse_channels(channel), byte_wid, window)
+        if self.debug:
+            print("Reading took: "+str(time.time() - t0)+"sec")
+        return (x.copy(),) + tuple(data) #callers may change x in place, the cached axis is read-only
+
+    def resync(self, timeout=None):
+        """
+        Bring the link and the oszi back into a known state after a failed read
+
+        Skips the rest of the interrupted answer (con.resync, e.g. half a curve in the
+        serial buffer), forgets the sent settings and the cached preambles, so they are
+        sent resp. queried again, and unfreezes the oszi. This costs one round trip
+        instead of creating a new Scope (reopening the port, *CLS, init writes).
+        """
+        self.metrics.count("resyncs")
+        self.con.resync(self.timeout if timeout is None else timeout)
+        self.invalidate_state()
+        self._set_acq_state("1")
+
+    def _retry(self, read, *args):
+        """
+        Call read(*args), after a communication error resync and call it again
+
+        The read is repeated at most self.retries times, waiting retry_delay, 2*retry_delay, ...
+        sec (at most MAX_RETRY_DELAY) before each retry. The link is resynced after the last
+        failure as well, so the oszi is not left frozen, then the error is raised.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return read(*args)
+            except RECOVERABLE_ERRORS as e:
+                error = e
+                if self.debug: traceback.print_exc()
             try:
-                print("An Error occurred")
-                self.con.close()
-                return (0,0)
-            except:
-                print("Error Closing")
-                return (0,0)
\ No newline at end of file
+                self.resync()
+            except RECOVERABLE_ERRORS as e:
+                error = e #still broken, the next attempt resyncs again
+            if attempt < self.retries:
+                self.metrics.count("retries")
+                time.sleep(min(self.retry_delay*2**attempt, MAX_RETRY_DELAY))
+        raise error
\ No newline at end of file
@@ -0,0 +1,15 @@
+"""
+Exceptions raised by the pyScopeTools modules
+"""
+
+class InvalidArgumentException(Exception):
+    """An argument passed to the scope is not valid for the oszi"""
+    pass
+
+class CommunicationException(Exception):
+    """The oszi answered with something unexpected"""
+    pass
+
+class TimeoutException(CommunicationException):
+    """The oszi did not answer within the given time"""
+    pass
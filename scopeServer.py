@@ -0,0 +1,309 @@
+"""
+Local acquisition server sharing one oszi between several processes (Python 3.8+)
+
+Only one process can own the serial port or the VISA session. The server owns the
+Scope, runs the acquisition loop and publishes the frames to any number of local
+clients:
+    - the frames are decoded into a ring of slots in shared memory
+      (multiprocessing.shared_memory), so the waveforms are not copied per client
+    - every new frame is announced over a Unix socket as one JSON line
+      {"seq": <frame number>, "slot": <slot>, "timestamp": <host time of the freeze>}
+
+start the server:
+python scopeServer.py COM1 --channel CH1CH2
+python scopeServer.py SIM::GPIB --socket /tmp/oszi.sock
+
+read frames in any number of other processes:
+    client = scopeServer.ScopeClient()
+    frame = client.get(timeout=10)  #acquisition.Frame with views into the shared memory
+    plt.plot(frame.x, frame.data[0])
+
+The server does not wait for the clients. A client that is too slow misses frames
+(counted in Frame.dropped), and a slot it still looks at can be overwritten by a
+newer frame: client.valid(frame) tells if the views still hold the data of the frame,
+copy the arrays if they are needed longer.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import select
+import signal
+import socket
+import tempfile
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+from scopeExceptions import CommunicationException, TimeoutException
+import acquisition
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), "pyScopeTools.sock")
+
+def frame_dtype(n_channels, n_points):
+    """numpy dtype of one slot of the shared memory ring"""
+    return np.dtype([('seq', '<i8'),       #number of the frame in the slot, -1 while it is written
+                     ('timestamp', '<f8'),
+                     ('x', '<f8', (n_points,)),
+                     ('data', '<f8', (n_channels, n_points))])
+
+def _attach(name):
+    """Open an existing shared memory block without letting this process remove it at exit"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) #python 3.13+
+    except TypeError:
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+def _server_running(path):
+    """True if a server accepts connections on the Unix socket path"""
+    if not os.path.exists(path):
+        return False
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError: #ConnectionRefusedError: nobody listens, the path is stale
+        return False
+    finally:
+        probe.close()
+
+
+class ScopeServer:
+    """
+    Acquire frames from the scope and publish them to the local clients
+
+    Arguments:
+    scope - the scope.Scope object, it must not be used by anything else while the server runs
+
+    Keyword arguments:
+    path - path of the Unix socket (default: DEFAULT_SOCKET)
+    channel, fast_mode, start, stop, stride - see Scope.readScope
+    slots - number of frames in the shared memory ring
+    """
+
+    def __init__(self, scope, path=DEFAULT_SOCKET, channel="CH1", fast_mode=True, slots=16, start=1, stop=None, stride=1):
+        if _server_running(path):
+            raise CommunicationException("Another server is already running on "+path)
+        self.scope = scope
+        self.path = path
+        self.channels = scope._parse_channels(channel)
+        self.byte_wid = 1 if fast_mode else 2
+        self.window = scope._record_window(start, stop, stride)
+        self.slots = slots
+        n_points = scope._window_points(self.window)
+        dtype = frame_dtype(len(self.channels), n_points)
+        self.shm = shared_memory.SharedMemory(create=True, size=dtype.itemsize*slots)
+        self.frames = np.ndarray((slots,), dtype=dtype, buffer=self.shm.buf)
+        self.frames['seq'] = -1
+        self.hello = {'shm': self.shm.name, 'slots': slots, 'channels': self.channels,
+                      'n_points': n_points, 'start': self.window[0], 'stride': self.window[2]}
+        self.error = None
+
+        if os.path.exists(path):
+            os.remove(path) #stale, left over from a server that was killed
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(8)
+        self.sock.settimeout(0.5)
+        self._clients = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def _send(self, client, message):
+        """
+        Send one JSON line without blocking, returns False if the client is gone or does not read
+
+        The socket buffer holds many messages, so it is only full (EAGAIN or a partial
+        write) if the client stopped reading; such a client is dropped instead of
+        letting it stall the acquisition.
+        """
+        data = (json.dumps(message)+"\n").encode('ascii')
+        try:
+            return client.send(data) == len(data)
+        except OSError: #BlockingIOError if the buffer is full
+            return False
+
+    def _broadcast(self, message):
+        with self._lock:
+            for client in [c for c in self._clients if not self._send(c, message)]:
+                self._clients.remove(client)
+                client.close()
+
+    def _accept(self):
+        while not self._stop_event.is_set():
+            try:
+                client, address = self.sock.accept()
+            except socket.timeout:
+                continue #check the stop event
+            except OSError:
+                break #socket closed
+            client.settimeout(0) #non-blocking, a client that does not read its messages is dropped
+            with self._lock:
+                if self._send(client, self.hello):
+                    self._clients.append(client)
+
+    def _acquire(self):
+        try:
+            n = 0
+            while not self._stop_event.is_set():
+                slot = n % self.slots
+                self.frames['seq'][slot] = -1
+                timestamp, x, data = self.scope._retry(self.scope._acquire, self.channels, self.byte_wid, self.window,
+                                                       False, self.frames['data'][slot], self.frames['x'][slot])
+                self.frames['timestamp'][slot] = timestamp
+                self.frames['seq'][slot] = n
+                self._broadcast({'seq': n, 'slot': slot, 'timestamp': timestamp})
+                n += 1
+        except Exception as e:
+            self.error = e
+            self._broadcast({'error': repr(e)})
+        finally:
+            self._stop_event.set()
+
+    def start(self):
+        """Start accepting clients and acquiring in background threads"""
+        for target in (self._accept, self._acquire):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def serve_forever(self):
+        """Run until the acquisition fails or stop() is called (e.g. by Ctrl+C)"""
+        self.start()
+        try:
+            while not self._stop_event.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        self._stop_event.set()
+
+    def close(self):
+        """Stop the acquisition, disconnect the clients and remove the socket and the shared memory"""
+        self._stop_event.set()
+        self.sock.close()
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        del self.frames
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ScopeClient:
+    """
+    Receive the frames of a ScopeServer
+
+    Keyword arguments:
+    path - path of the Unix socket of the server (default: DEFAULT_SOCKET)
+    timeout - default timeout in sec of get() (default: None, wait forever)
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, timeout=None):
+        self.timeout = timeout
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self._pending = b"" #received data after the last complete message
+        hello = self._receive(timeout)
+        self.channels = hello['channels']
+        self.start = hello['start']
+        self.stride = hello['stride']
+        self.slots = hello['slots']
+        self.shm = _attach(hello['shm'])
+        self.frames = np.ndarray((self.slots,), dtype=frame_dtype(len(self.channels), hello['n_points']),
+                                 buffer=self.shm.buf)
+        self.dropped = 0 #total number of frames missed
+        self._last = None
+
+    def _receive(self, timeout):
+        """Return the next message, waiting with select, so a timeout leaves the socket usable"""
+        deadline = None if timeout is None else time.time() + timeout
+        while b"\n" not in self._pending:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            if not select.select([self.sock], [], [], remaining)[0]:
+                raise TimeoutException("No frame available")
+            data = self.sock.recv(65536)
+            if not data:
+                raise CommunicationException("The server closed the connection")
+            self._pending += data
+        line, self._pending = self._pending.split(b"\n", 1)
+        message = json.loads(line.decode('ascii'))
+        if 'error' in message:
+            raise CommunicationException("The acquisition of the server failed: "+message['error'])
+        return message
+
+    def get(self, timeout=None):
+        """
+        Return the next frame as acquisition.Frame
+
+        The arrays are views into the shared memory, see valid(). Frames that were
+        overwritten before they were read are skipped and counted in Frame.dropped.
+        """
+        dropped = 0
+        while True:
+            message = self._receive(self.timeout if timeout is None else timeout)
+            if self._last is not None:
+                dropped += message['seq'] - self._last - 1
+            self._last = message['seq']
+            slot = message['slot']
+            if self.frames['seq'][slot] == message['seq']:
+                break
+            dropped += 1 #already overwritten
+        self.dropped += dropped
+        return acquisition.Frame(message['seq'], message['timestamp'], self.frames['x'][slot],
+                                 self.frames['data'][slot], dropped)
+
+    def valid(self, frame):
+        """True if the arrays of the frame were not overwritten by a newer frame yet"""
+        return self.frames['seq'][frame.index % self.slots] == frame.index
+
+    def close(self):
+        del self.frames
+        self.shm.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main(argv=None):
+    import scope
+    parser = argparse.ArgumentParser(description="Share the frames of one oszi with local processes")
+    parser.add_argument("address", help='address of the oszi, e.g. "COM1", "GPIB0::1::INSTR" or "SIM::COM"')
+    parser.add_argument("--baudrate", default="9600", help='serial baudrate or "auto" (default: %(default)s)')
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="path of the Unix socket (default: %(default)s)")
+    parser.add_argument("--channel", default="CH1", help='"CH1", "CH2" or "CH1CH2"')
+    parser.add_argument("--normal", action="store_true", help="transfer 2 bytes per point instead of 1")
+    parser.add_argument("--slots", type=int, default=16, help="frames in the shared memory ring")
+    args = parser.parse_args(argv)
+    if args.baudrate != "auto":
+        args.baudrate = int(args.baudrate)
+
+    server = ScopeServer(scope.Scope(args.address, args.baudrate), args.socket, args.channel,
+                         fast_mode=not args.normal, slots=args.slots)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop()) #clean up the shared memory on kill
+    print("serving {:s} on {:s}".format(args.address, args.socket))
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
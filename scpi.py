@@ -0,0 +1,114 @@
+"""
+Parsing of the messages of the oszi (IEEE-488.2 headers)
+
+A compound message consists of message units separated by ';'. A header without a
+leading ':' is relative to the node of the previous unit, e.g. the answer to
+"TRIG:MAI?"
+    :TRIGGER:MAIN:MODE AUTO;TYPE EDGE;LEVEL 0.0E0;HOLDOFF:VALUE 5.0E-7;:TRIGGER:MAIN:EDGE:SOURCE CH1
+contains the settings TRIG:MAI:MOD, TRIG:MAI:TYP, TRIG:MAI:LEV, TRIG:MAI:HOL:VAL and
+TRIG:MAI:EDGE:SOU. Headers are reduced to the short form of their mnemonics, so the
+long and the short form (and everything in between) give the same key.
+
+usage:
+    for key, value in scpi.parse_response(myscope.con.query("CH1?")):
+        print(key, scpi.number(value))
+"""
+
+#long form of the mnemonics, the upper case part is the short form
+MNEMONICS = ["ACQuire", "STATE", "STOPAfter", "DATa", "ENCdg", "WIDth", "STARt", "STOP", "SOUrce",
+             "WFMPre", "XINcr", "XZEro", "YMUlt", "YZEro", "YOFf", "XUNit", "YUNit", "CURVe",
+             "CH1", "CH2", "PRObe", "SCAle", "POSition", "COUPling", "BANdwidth", "VOLts",
+             "HORizontal", "MAIn", "SECdiv", "TRIGger", "MODe", "TYPe", "LEVel", "EDGE", "SLOpe",
+             "HOLdoff", "VALue", "HEADer", "BUSY", "ID", "RS232", "TRANsmit", "TERMinator",
+             "BAUd", "HARDFlagging", "SOFTFlagging", "PARity", "*OPC", "*CLS", "*ESE", "*ESR",
+             "*SRE", "*STB", "*IDN", "*RST", "VERBose", "SEQuence", "RUNSTop"]
+_SHORT = dict((m.rstrip("abcdefghijklmnopqrstuvwxyz").upper(), m.upper()) for m in MNEMONICS)
+
+def canonical(mnemonic):
+    """Return the short form of a mnemonic given in short or long form (or any length in between)"""
+    m = mnemonic.upper()
+    for short, long_form in _SHORT.items():
+        if m.startswith(short) and long_form.startswith(m):
+            return short
+    return m
+
+def long_form(short):
+    return _SHORT.get(short, short)
+
+def nr3(value):
+    """Format a float like the oszi does, e.g. 1.0E-3"""
+    mantissa, exponent = ("%.4E" % value).split("E")
+    mantissa = mantissa.rstrip("0")
+    if mantissa.endswith("."):
+        mantissa += "0"
+    return mantissa+"E"+str(int(exponent))
+
+def number(value):
+    """Convert a value to int or float if it is a number, otherwise return it unchanged"""
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+def same_value(a, b):
+    """True if two values are equal, numbers are compared by value (e.g. "1.00E+00" and "1.0E0")"""
+    if a == b:
+        return True
+    if a is None or b is None:
+        return False
+    try:
+        return float(a) == float(b)
+    except ValueError:
+        return a.upper() == b.upper()
+
+def split_units(message):
+    """Split a compound message at the ';' that are not inside of a quoted string"""
+    units = []
+    start = 0
+    quote = None
+    for i, c in enumerate(message):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in "\"'":
+            quote = c
+        elif c == ";":
+            units.append(message[start:i])
+            start = i+1
+    units.append(message[start:])
+    return [u.strip() for u in units if u.strip()]
+
+def resolve(message):
+    """
+    Split a compound message into (key, argument, query) tuples
+
+    key is the header in short form without the leading ':' (e.g. "CH1:SCA"), relative
+    headers are resolved. argument is the rest of the message unit ("" if there is none).
+    """
+    node = []
+    result = []
+    for unit in split_units(message):
+        header, _, argument = unit.partition(' ')
+        query = header.endswith('?')
+        header = header.rstrip('?')
+        if header.startswith('*'):
+            path = [canonical(header)] #common commands do not change the node
+        else:
+            if header.startswith(':'):
+                node = []
+            path = node + [canonical(m) for m in header.lstrip(':').split(':')]
+            node = path[:-1]
+        result.append((":".join(path), argument.strip(), query))
+    return result
+
+def parse_response(answer):
+    """
+    Return the (key, value) pairs of an answer with headers (HEAD ON)
+
+    The values are the strings sent by the oszi, see number() to convert them.
+    """
+    return [(key, value) for key, value, query in resolve(answer.strip())]
@@ -5,6 +5,11 @@ import time
 
 import logging, logging.handlers
 
+from scopeExceptions import CommunicationException, TimeoutException
+import synchronization
+import metrics
+import transport
+
 logger = logging.getLogger('ScopeLogger')        
 #handler = logging.handlers.RotatingFileHandler('C:/Temp/pyScopeTools.log', maxBytes=1024*1024*50)
 #handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
@@ -12,52 +17,137 @@ logger = logging.getLogger('ScopeLogger')
 #logger.setLevel(logging.DEBUG)
 #logger.addHandler(handler) 
 
-class SerialComm:
+BAUDRATES = (19200, 9600, 4800, 2400, 1200, 600, 300) #supported by the RS232 interface of the oszi, fastest first
+
+class SerialComm(transport.Transport):
+    """
+    Serial connection to the oszi
+
+    baudrate - baudrate of the port, it has to match the RS232 setting of the oszi.
+               "auto" detects the baudrate the oszi uses and raises it to the fastest
+               one that works (see negotiate_baudrate). NOTICE: the oszi keeps this
+               setting, so other programs have to use the new baudrate as well.
+    """
 
     def __init__(self, address, baudrate=9600, timeout=2000, eol='\r\n'):
-        self.serial = serial.Serial(port=address, baudrate=baudrate)
+        auto = baudrate == "auto"
+        self.serial = serial.Serial(port=address, baudrate=BAUDRATES[1] if auto else baudrate)
         self.serial.flushInput()
         self.serial.flushOutput()
         self.serial.timeout = timeout
         self.eol = eol
         self.b_eol = eol.encode('ascii')
-        
+        self.metrics = metrics.NULL_METRICS #see metrics.py
+
+        if auto:
+            self.detect_baudrate()
+            self.negotiate_baudrate()
         self.do_init_oszi()
         
     def do_init_oszi(self):
         self.writeline("*CLS") #clear status
         self.writeline("RS232:TRANS:TERM CRLF") #config OSZI line termination characters
 
+    def _switch_port(self, baudrate, rtscts=False):
+        self.serial.baudrate = baudrate
+        self.serial.rtscts = rtscts
+        self.serial.flushInput()
+
+    def _probe(self):
+        """Check the link with "ID?", returns True if the oszi answered"""
+        self.serial.flushInput()
+        self.serial.write(self.b_eol) #terminate garbage the oszi received at a wrong baudrate
+        self.writeline("ID?")
+        timeout = max(0.5, 100*10.0/self.serial.baudrate) #the answer has about 60 bytes
+        oldTimeout = self.serial.timeout
+        try:
+            #the oszi might still terminate its answers with LF only
+            answer = self._read_until(b'\n', time.time() + timeout)
+        except TimeoutException:
+            return False
+        finally:
+            self.serial.timeout = oldTimeout
+        return answer.strip().startswith(b"ID")
+
+    def _set_rs232(self, baudrate, hard_flagging):
+        """Change the baudrate and flow control of the oszi (not of the port)"""
+        self.serial.write(self.b_eol) #terminate garbage the oszi received at a wrong baudrate
+        self.writeline(":RS232:HARDF {:s};BAUD {:d}".format("ON" if hard_flagging else "OFF", baudrate))
+        self.serial.flush() #the command has to be sent completely at the old baudrate
+        time.sleep(0.1)     #give the oszi time to switch
+
+    def detect_baudrate(self, baudrates=BAUDRATES):
+        """
+        Find the baudrate the oszi uses, starting with the current one of the port
+
+        Raises a CommunicationException if the oszi does not answer at any baudrate.
+        """
+        current = self.serial.baudrate
+        for baudrate in [current] + [b for b in baudrates if b != current]:
+            self._switch_port(baudrate)
+            if self._probe():
+                logger.info("oszi found at %d baud", baudrate)
+                return baudrate
+        self._switch_port(current)
+        raise CommunicationException("The oszi does not answer at any baudrate")
+
+    def negotiate_baudrate(self, baudrates=BAUDRATES, hard_flagging=True):
+        """
+        Raise the baudrate of the oszi and the port to the fastest one that works
+
+        The rates faster than the current one are tried, fastest first: the oszi is
+        switched by ":RS232:HARDF ON;BAUD <rate>", the port follows (with RTS/CTS flow
+        control) and the link is checked with "ID?". If the check fails, the oszi is
+        set back to the previous baudrate without flow control and the next slower
+        rate is tried. Returns the baudrate in use.
+        """
+        current = self.serial.baudrate
+        for baudrate in sorted((b for b in baudrates if b > current), reverse=True):
+            self._set_rs232(baudrate, hard_flagging)
+            self._switch_port(baudrate, hard_flagging)
+            if self._probe():
+                logger.info("switched to %d baud", baudrate)
+                return baudrate
+            logger.info("no connection at %d baud, falling back to %d", baudrate, current)
+            self._switch_port(current)
+            if self._probe():
+                continue #the oszi did not switch
+            #the oszi switched, but the link does not work (e.g. no flow control lines in the cable)
+            self._switch_port(baudrate)
+            self._set_rs232(current, False)
+            self._switch_port(current)
+            if not self._probe():
+                raise CommunicationException("Lost the connection to the oszi while changing the baudrate")
+        return self.serial.baudrate
+
     def inWaiting(self):
         return self.serial.inWaiting()   
         
-    def readline(self):
-        logger.info("readline")
-        out = b""
-        sleep_amount = 0
-        while (not self.b_eol in out) and sleep_amount < 5:
-            if self.serial.inWaiting() > 0:
-                out += self.serial.read(self.serial.inWaiting())
-                logger.info(out.decode('ascii'))
-                #time.sleep(0.01)
-                sleep_amount = 0
-            else:
-                sleep_amount += 1
-                time.sleep(0.1)
+    def readline(self, timeout=None):
+        """
+        Read one answer line of the oszi
 
-        if sleep_amount >= 5:
-            print("Sleep amount limit is reached. so the message may not be complete")    
-            logger.info('sleep amount reached')
+        Blocks until the line termination arrived, so the answer is returned as soon
+        as the oszi sent it. Raises a TimeoutException if this takes longer than
+        timeout sec (default: the port timeout) and a CommunicationException if the
+        answer is not ASCII (e.g. garbled by noise on the line).
+        """
+        if timeout is None:
+            timeout = self.serial.timeout
+        oldTimeout = self.serial.timeout
+        try:
+            out = self._read_until(self.b_eol, time.time() + timeout)
+        finally:
+            self.serial.timeout = oldTimeout
 
+        self.metrics.count("bytes_read", len(out))
         try:
             out = out.decode('ascii')
-            logger.info("read: "+out)  
-        except:
-            print("Error parsing output: ")
-            print(out)
+        except UnicodeDecodeError:
+            raise CommunicationException("Garbled answer of the oszi: "+repr(out))
+        logger.debug("read: %s", out)
         return out.replace(self.eol,'\n')
 
-        
     def read(self, bytes=1):
         return self.serial.read(bytes).decode('ascii')
         
@@ -75,19 +165,95 @@ class SerialComm:
         if sleep_amount >= 5:
             print("Sleep amount limit is reached. so the message may not be complete")    
             logger.info('sleep amount reached')
+            self.metrics.count("timeouts")
 
+        self.metrics.count("bytes_read", len(out))
         return out.replace(self.b_eol,b'\n')
 
+    def read_block(self, expected_bytes=None, timeout=None):
+        """
+        Read an IEEE-488.2 definite length block, e.g. the answer to "CURV?"
+
+        The answer looks like ':CURVE #42500<2500 data bytes>\r\n'. Everything in front
+        of the '#' is skipped, then exactly the announced number of data bytes and the
+        line termination are read. In contrast to readline_raw() there is no polling,
+        so the read returns as soon as the last byte arrived.
+
+        A '#' in noise in front of the block is skipped (see transport.Transport._read_block).
+
+        Keyword arguments:
+        expected_bytes - if given, the announced block length must match this value
+        timeout - deadline in sec for the whole block (default: the port timeout)
+
+        Returns only the data bytes of the block.
+        """
+        if timeout is None:
+            timeout = self.serial.timeout
+        oldTimeout = self.serial.timeout
+        try:
+            return self._read_block(expected_bytes, time.time() + timeout)
+        finally:
+            self.serial.timeout = oldTimeout
+
+    def _read_exact(self, size, deadline):
+        out = bytearray(size) #filled in place, a long block is not concatenated from its pieces
+        view = memoryview(out)
+        n = 0
+        while n < size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.metrics.count("timeouts")
+                raise TimeoutException("Timeout while reading: got {:d} of {:d} bytes".format(n, size))
+            self.metrics.count("poll_iterations")
+            self.serial.timeout = remaining
+            n += self.serial.readinto(view[n:])
+        return out
+
+    def _read_until(self, terminator, deadline):
+        out = b""
+        while not out.endswith(terminator):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.metrics.count("timeouts")
+                raise TimeoutException("Timeout while waiting for "+repr(terminator))
+            self.metrics.count("poll_iterations")
+            self.serial.timeout = remaining
+            out += self.serial.read_until(terminator)
+        return out
+
+    def wait_ready(self, timeout=None):
+        """Block until the oszi has finished all pending operations (*OPC? handshake)"""
+        synchronization.wait_opc(self, self.serial.timeout if timeout is None else timeout)
+
+    def clear(self):
+        """Drop received data that was not read yet, e.g. the rest of an interrupted read"""
+        self.serial.flushInput()
+
+    def resync(self, timeout=None):
+        """Skip the rest of an interrupted answer, see transport.Transport.resync"""
+        oldTimeout = self.serial.timeout
+        try:
+            transport.Transport.resync(self, self.serial.timeout if timeout is None else timeout)
+        finally:
+            self.serial.timeout = oldTimeout
+
+    def close(self):
+        self.serial.close()
+
+    def wait_acquisition(self, timeout=None):
+        """Block until a single sequence acquisition is complete (polls ACQ:STATE?)"""
+        synchronization.wait_acquisition(self, self.serial.timeout if timeout is None else timeout)
+
     def write(self, message):
         self.writeline(message)
     
     def writeline(self, message):
-        logger.info("writeline: "+message)
-        self.serial.write((message+self.eol).encode('ascii'))
-        logger.info("in waiting: "+str(self.inWaiting()))
+        logger.debug("writeline: %s", message)
+        data = (message+self.eol).encode('ascii')
+        self.serial.write(data)
+        self.metrics.count("bytes_written", len(data))
         
     def query(self, msg, timeout=None):
-        logger.info("query")
         oldTimeout = self.serial.timeout
         if timeout:
             self.serial.timeout = timeout
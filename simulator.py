@@ -0,0 +1,424 @@
+"""
+Simulated TDS210 for testing and benchmarking without hardware
+
+SimulatedTDS210 can be used everywhere a SerialComm or GPIBComm is used. It
+understands the commands the Scope class sends (HEAD, ACQ:STATE, ACQ:STOPA, DAT:*, WFMPre:*?,
+CURV?, CH<n>?, HOR:MAI?, TRIG:MAI?, *OPC?, BUSY?, ...) in short and long form,
+generates synthetic waveforms (CH1: sine, CH2: square), triggers single sequences
+(ACQ:STOPA SEQ) after a random time if trigger_rate is set, loses the end of a
+curve with the probability glitch_rate (to try the recovery of Scope), and models the time
+the link needs:
+    serial - 10 bit per byte at the given baudrate, in both directions
+    GPIB - a fixed overhead per bus transaction plus a limited throughput
+
+The modeled link time is summed up in link_time. It is also spent as real
+time (time.sleep), multiplied by time_scale, so time_scale=0 runs as fast
+as possible while link_time still tells the modeled duration.
+
+Use it via the address of the scope:
+    myscope = scope.Scope("SIM::COM", baudrate=9600) #serial link
+    myscope = scope.Scope("SIM::GPIB")               #GPIB link
+
+The default GPIB model (15ms per transaction, 14kB/s) is fitted to the timings
+noted in scope.py: the 12 transactions and ~2650 resp. ~5150 bytes of a single
+channel read of the original readScope (without its settle sleep) take 0.37sec
+(1 byte) and 0.55sec (2 bytes). At 9600 baud the serial model gives 2.8sec and 5.4sec
+for the same reads (measured: 2.7sec and 5.3sec).
+"""
+
+from __future__ import print_function
+import math
+import time
+import numpy as np
+
+from scopeExceptions import CommunicationException, TimeoutException
+import synchronization
+import metrics
+import scpi
+import transport
+from scpi import canonical, long_form, nr3
+from serialConnection import BAUDRATES
+
+ID = "ID TEK/TDS 210,CF:91.1CT,FV:v1.17 TDS2CM:CMV:v1.04"
+
+class SimulatedTDS210(transport.Transport):
+    """
+    Simulated oszi with the interface of SerialComm/GPIBComm
+
+    Keyword arguments:
+    link - "serial" or "gpib"
+    baudrate - baudrate of the serial link, "auto" switches to the fastest baudrate of the
+               oszi like SerialComm does (the simulated port always follows the oszi)
+    transaction_overhead - GPIB: time in sec for every bus transaction
+    gpib_rate - GPIB: throughput in bytes/sec
+    time_scale - factor for the real time spent for the modeled link time (0: do not sleep)
+    timeout - read timeout in sec (only used as default for wait_ready)
+    """
+
+    def __init__(self, address="SIM::COM", baudrate=9600, timeout=5, eol='\r\n', link=None,
+                 transaction_overhead=0.015, gpib_rate=14000, time_scale=1.0):
+        if link is None:
+            link = "gpib" if "GPIB" in address.upper() else "serial"
+        if link not in ("serial", "gpib"):
+            raise ValueError("link must be 'serial' or 'gpib'")
+        self.link = link
+        auto = baudrate == "auto"
+        if auto:
+            baudrate = 9600
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.eol = eol
+        self.b_eol = eol.encode('ascii')
+        self.transaction_overhead = transaction_overhead
+        self.gpib_rate = gpib_rate
+        self.time_scale = time_scale
+
+        #statistics
+        self.link_time = 0.0
+        self.transactions = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.metrics = metrics.NULL_METRICS
+
+        self._output = [] #answer lines not yet read
+        self._esr = 0
+        self._ese = 0
+        self._t0 = time.time()
+        self.settings = {
+            "HEAD": "1", "ACQ:STATE": "1", "ACQ:STOPA": "RUNST",
+            "DAT:ENC": "RIB", "DAT:WID": "1", "DAT:STAR": "1", "DAT:STOP": "2500", "DAT:SOU": "CH1",
+            "HOR:MAI:SCA": "5.0E-4", "HOR:MAI:POS": "0.0E0",
+            "TRIG:MAI:MOD": "AUTO", "TRIG:MAI:TYP": "EDGE", "TRIG:MAI:LEV": "0.0E0",
+            "TRIG:MAI:HOL:VAL": "5.0E-7", "TRIG:MAI:EDGE:SOU": "CH1",
+            "TRIG:MAI:EDGE:COUP": "DC", "TRIG:MAI:EDGE:SLO": "RISE",
+            "RS232:BAU": str(baudrate), "RS232:HARDF": "OFF", "RS232:TRAN:TERM": "LF",
+        }
+        for ch in ("CH1", "CH2"):
+            self.settings.update({ch+":PRO": "1", ch+":SCA": "1.0E0", ch+":POS": "0.0E0",
+                                  ch+":COUP": "DC", ch+":BAN": "OFF"})
+        #synthetic signals: (frequency in Hz, amplitude in V)
+        self.signals = {"CH1": (1000.0, 2.0), "CH2": (500.0, 1.0)}
+        self.noise = 0.02
+        self._frozen = None #waveforms at the time of the freeze
+        #single sequence (ACQ:STOPA SEQ): trigger events per sec, None: the signal triggers in every period
+        self.trigger_rate = None
+        self._trigger_at = None #time of the trigger event of the armed sequence
+        self._pending_opc = False #*OPC was sent while a sequence was armed
+        self.glitch_rate = 0.0 #probability that the end of a curve answer is lost on the link
+        self.glitches = 0
+        self.do_init_oszi()
+        if auto and link == "serial":
+            self.negotiate_baudrate()
+
+    def do_init_oszi(self):
+        self.writeline("*CLS")
+        if self.link == "serial":
+            self.writeline("RS232:TRANS:TERM CRLF")
+
+    def negotiate_baudrate(self, baudrates=BAUDRATES, hard_flagging=True):
+        self.writeline(":RS232:HARDF {:s};BAUD {:d}".format("ON" if hard_flagging else "OFF", max(baudrates)))
+        self.query("ID?")
+        return self.baudrate
+
+    # ---- link model ----
+
+    def _transfer(self, nbytes):
+        if self.link == "serial":
+            dt = nbytes*10.0/self.baudrate
+        else:
+            dt = self.transaction_overhead + nbytes/float(self.gpib_rate)
+        self.transactions += 1
+        self.link_time += dt
+        if self.time_scale:
+            time.sleep(dt*self.time_scale)
+
+    def _now(self):
+        """Time of the simulated signals, includes the modeled link time if time_scale is 0"""
+        return time.time() - self._t0 + (0 if self.time_scale else self.link_time)
+
+    # ---- interface of SerialComm/GPIBComm ----
+
+    def writeline(self, message):
+        data = (message+self.eol).encode('ascii')
+        self.bytes_written += len(data)
+        self.metrics.count("bytes_written", len(data))
+        self._transfer(len(data))
+        answers = self._execute(message)
+        if answers:
+            answer = b";".join(answers)+self.b_eol
+            if self.glitch_rate and b"#" in answer and np.random.random_sample() < self.glitch_rate:
+                answer = answer[:np.random.randint(answer.index(b"#"), len(answer) - len(self.b_eol))]
+                self.glitches += 1
+            self._output.append(answer)
+
+    def write(self, message):
+        self.writeline(message)
+
+    def _pop_output(self):
+        if not self._output:
+            self.metrics.count("timeouts")
+            raise TimeoutException("The simulated oszi has nothing to send")
+        data = self._output.pop(0)
+        self.bytes_read += len(data)
+        self.metrics.count("bytes_read", len(data))
+        self._transfer(len(data))
+        return data
+
+    def readline(self, timeout=None):
+        return self._pop_output().decode('ascii').replace(self.eol, '\n')
+
+    def readline_raw(self, min_bytes=0):
+        return self._pop_output().replace(self.b_eol, b'\n')
+
+    def read(self, bytes=1):
+        return self.readline()
+
+    def read_block(self, expected_bytes=None, timeout=None):
+        data = self._pop_output()
+        start, length = transport.find_block(data, expected_bytes)
+        block = data[start:start+length]
+        if len(block) < length:
+            self.metrics.count("timeouts")
+            raise TimeoutException("Timeout while reading: got {:d} of {:d} bytes".format(len(block), length))
+        return block
+
+    def query(self, msg, timeout=None):
+        self.writeline(msg)
+        return self.readline(timeout)
+
+    def read_stb(self):
+        if self.link != "gpib":
+            raise CommunicationException("Serial polls are only possible with GPIB")
+        self._transfer(1)
+        self._update_acquisition()
+        return synchronization.ESB if self._esr & self._ese else 0
+
+    def wait_acquisition(self, timeout=None):
+        if self.link == "gpib":
+            synchronization.wait_status_byte(self, self.timeout if timeout is None else timeout, max_interval=0.2)
+        else:
+            synchronization.wait_acquisition(self, self.timeout if timeout is None else timeout)
+
+    def wait_ready(self, timeout=None):
+        if self.link == "gpib":
+            synchronization.wait_status_byte(self, self.timeout if timeout is None else timeout)
+        else:
+            synchronization.wait_opc(self, self.timeout if timeout is None else timeout)
+
+    def close(self):
+        pass
+
+    def clear(self):
+        self._output = []
+
+    def resync(self, timeout=None):
+        self.clear()
+
+    # ---- command interpreter ----
+
+    def _execute(self, line):
+        """Execute a (compound) command line, return the list of answers"""
+        self._update_acquisition()
+        answers = []
+        for key, argument, query in scpi.resolve(line):
+            if query:
+                answer = self._query(key)
+                if answer is not None:
+                    answers.append(answer.encode('ascii') if not isinstance(answer, bytes) else answer)
+            else:
+                self._set(key, argument)
+        return answers
+
+    def _header(self, key):
+        if self.settings["HEAD"] in ("0", "OFF"):
+            return ""
+        return ":"+":".join(long_form(m) for m in key.split(":"))+" "
+
+    def _query(self, key):
+        if key == "*OPC":
+            return "1"
+        if key == "*ESR":
+            esr, self._esr = self._esr, 0
+            return str(esr)
+        if key == "ID":
+            return ID
+        if key == "BUSY":
+            return self._header(key)+"0"
+        if key == "CURV":
+            return self._curve()
+        if key.startswith("WFMP:"):
+            return self._header(key)+self._preamble()[long_form(key[5:])]
+        if key in ("CH1", "CH2", "HOR:MAI", "HOR", "TRIG:MAI", "TRIG", "DAT", "ACQ"):
+            return self._node_query(key)
+        if key in self.settings:
+            return self._header(key)+self.settings[key]
+        return None
+
+    def _node_query(self, key):
+        """
+        Answer of a node query like "CH1?"
+
+        The first setting gets the full header, the following ones are relative to
+        the node of the previous one, like ":TRIGGER:MAIN:MODE AUTO;TYPE EDGE;HOLDOFF:VALUE 5.0E-7;
+        :TRIGGER:MAIN:EDGE:SOURCE CH1;COUPLING DC"
+        """
+        if key in ("HOR", "TRIG"):
+            key += ":MAI"
+        base = [long_form(m) for m in key.split(":")]
+        items = []
+        node = None
+        for k, v in self.settings.items():
+            if not k.startswith(key+":"):
+                continue
+            if self.settings["HEAD"] in ("0", "OFF"):
+                items.append(v)
+                continue
+            path = [long_form(m) for m in k.split(":")]
+            if path[:-1] == node:
+                header = path[-1]
+            elif node == base and path[:len(base)] == base:
+                header = ":".join(path[len(base):])
+            else:
+                header = ":"+":".join(path)
+            node = path[:-1]
+            items.append(header+" "+v)
+        return ";".join(items)
+
+    def _set(self, key, argument):
+        if key == "*CLS":
+            self._esr = 0
+        elif key == "*ESE":
+            self._ese = int(argument)
+        elif key == "*OPC":
+            if self._trigger_at is not None:
+                self._pending_opc = True #the sequence is an operation, it completes with the trigger
+            else:
+                self._esr |= 1
+        elif key in ("*SRE", "*RST"):
+            pass
+        elif key == "ACQ:STATE":
+            running = argument.upper() not in ("0", "OFF", "STOP")
+            self._trigger_at = None
+            if not running and self._frozen is None:
+                self._frozen = self._now()
+            elif running and self.settings["ACQ:STOPA"] == "SEQ":
+                #armed: wait for the next trigger, then stop
+                frequency, amplitude = self.signals[self.settings["TRIG:MAI:EDGE:SOU"]]
+                wait = np.random.exponential(1.0/self.trigger_rate) if self.trigger_rate else 1.0/frequency
+                self._trigger_at = self._now() + wait
+                self._frozen = None
+            elif running:
+                self._frozen = None
+            self.settings[key] = "1" if running else "0"
+        elif key == "ACQ:STOPA":
+            self.settings[key] = canonical(argument)
+        elif key == "RS232:BAU":
+            if int(argument) in BAUDRATES:
+                self.settings[key] = argument
+                self.baudrate = int(argument) #the answers are already sent at the new baudrate
+        elif key == "HEAD":
+            self.settings[key] = "0" if argument.upper() in ("0", "OFF") else "1"
+        else:
+            value = argument.upper()
+            for k in ("SCA", "POS", "LEV"):
+                if key.endswith(":"+k):
+                    value = nr3(float(argument))
+            if key == "DAT:SOU":
+                value = canonical(value)
+            self.settings[key] = value
+
+    def _update_acquisition(self):
+        """Stop an armed single sequence if its trigger event has happened"""
+        if self._trigger_at is not None and self._now() >= self._trigger_at:
+            self._frozen = self._trigger_at
+            self._trigger_at = None
+            self.settings["ACQ:STATE"] = "0"
+            if self._pending_opc:
+                self._esr |= 1
+                self._pending_opc = False
+
+    # ---- waveform synthesis ----
+
+    def _preamble(self):
+        source = self.settings["DAT:SOU"]
+        width = int(self.settings["DAT:WID"])
+        scale = float(self.settings[source+":SCA"])
+        position = float(self.settings[source+":POS"])
+        xincr = float(self.settings["HOR:MAI:SCA"])*10/2500
+        ymult = scale/25.0/(256 if width == 2 else 1)
+        yoff = position*25*(256 if width == 2 else 1)
+        xzero = float(self.settings["HOR:MAI:POS"]) - 1250*xincr
+        return {"XINCR": nr3(xincr), "XZERO": nr3(xzero), "YMULT": nr3(ymult), "YZERO": "0.0E0",
+                "YOFF": nr3(yoff), "XUNIT": '"s"', "YUNIT": '"Volts"'}
+
+    def _samples(self):
+        """The raw samples of the current source in the DAT:STAR..DAT:STOP window"""
+        source = self.settings["DAT:SOU"]
+        width = int(self.settings["DAT:WID"])
+        start, stop = sorted((int(self.settings["DAT:STAR"]), int(self.settings["DAT:STOP"])))
+        stop = min(stop, 2500)
+        p = self._preamble()
+        t0 = self._frozen if self._frozen is not None else self._now()
+        t = (np.arange(start-1, stop)*float(p["XINCR"]) + float(p["XZERO"]))
+        frequency, amplitude = self.signals[source]
+        phase = 2*math.pi*frequency*(t + t0)
+        if source == "CH1":
+            volts = amplitude*np.sin(phase)
+        else:
+            volts = amplitude*np.sign(np.sin(phase))
+        #the same frozen acquisition always gives the same noise
+        volts += self.noise*np.random.RandomState(int(t0*1e6) % 2**32).standard_normal(len(t))
+        raw = np.round(volts/float(p["YMULT"]) + float(p["YOFF"]))
+        if width == 1:
+            return np.clip(raw, -128, 127).astype('b')
+        return np.clip(raw, -32768, 32767).astype('>i2')
+
+    def _curve(self):
+        data = self._samples().tobytes()
+        length = str(len(data))
+        return (self._header("CURV") + "#"+str(len(length))+length).encode('ascii') + data
+
+
+def serve_client(connection, **kwargs):
+    """
+    Answer the commands of one client of a TCP socket until it disconnects
+
+    Keyword arguments: see SimulatedTDS210 (default: GPIB link without sleeping)
+    """
+    kwargs.setdefault("link", "gpib")
+    kwargs.setdefault("time_scale", 0)
+    sim = SimulatedTDS210("SIM::TCP", **kwargs)
+    pending = b""
+    while True:
+        data = connection.recv(4096)
+        if not data:
+            break
+        pending += data
+        while b"\n" in pending:
+            line, pending = pending.split(b"\n", 1)
+            sim.writeline(line.rstrip(b"\r").decode('ascii'))
+            while sim._output:
+                connection.sendall(sim._pop_output())
+    connection.close()
+
+def serve(port=5025, host="127.0.0.1", **kwargs):
+    """
+    Serve a simulated oszi on a raw TCP socket, one client at a time, e.g. to try the
+    socket backend: scope.Scope("tcp://127.0.0.1:5025")
+    """
+    import socket
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(1)
+    try:
+        while True:
+            connection, address = listener.accept()
+            serve_client(connection, **kwargs)
+    finally:
+        listener.close()
+
+if __name__ == "__main__":
+    import sys
+    print("simulated oszi on tcp://127.0.0.1:{:d}".format(int(sys.argv[1]) if len(sys.argv) > 1 else 5025))
+    serve(int(sys.argv[1]) if len(sys.argv) > 1 else 5025)
@@ -0,0 +1,70 @@
+from __future__ import print_function
+import socket
+
+from scopeExceptions import CommunicationException, InvalidArgumentException
+import transport
+
+"""
+Raw TCP connection, for LAN-serial servers (ser2net, Moxa NPort, ...) and LAN-GPIB
+gateways in a transparent mode: the bytes are passed through to the oszi unchanged.
+Gateways that need their own commands (e.g. "++addr 1" of Prologix) can get them
+with init_commands.
+
+address: "tcp://host:port", e.g. "tcp://192.168.0.20:4001"
+"""
+
+DEFAULT_PORT = 5025 #SCPI raw socket
+
+def parse_address(address):
+    """Return (host, port) of an address "tcp://host:port" or "socket://host:port" """
+    rest = address.split("://", 1)[-1].rstrip("/")
+    host, _, port = rest.rpartition(":")
+    if not host:
+        host, port = port, DEFAULT_PORT
+    try:
+        return host.strip("[]"), int(port)
+    except ValueError:
+        raise InvalidArgumentException("Invalid port in the address "+repr(address))
+
+
+class SocketComm(transport.StreamTransport):
+    """
+    Raw TCP connection to the oszi
+
+    Keyword arguments:
+    timeout - timeout in sec of the connect and the default deadline of the reads
+    chunk_size - size of the receive buffer in bytes, a block is always received
+                 directly into a buffer of its size
+    init_commands - lines sent to the gateway after connecting
+    """
+
+    def __init__(self, address, timeout=5, eol='\r\n', chunk_size=65536, init_commands=()):
+        transport.StreamTransport.__init__(self, timeout, eol, chunk_size)
+        self.address = parse_address(address)
+        try:
+            self.sock = socket.create_connection(self.address, timeout)
+        except (OSError, socket.error) as e:
+            raise CommunicationException("Cannot connect to {:s}:{:d}: {!s}".format(self.address[0], self.address[1], e))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) #commands are short, do not delay them
+        for command in init_commands:
+            self.writeline(command)
+        self.do_init_oszi()
+
+    def do_init_oszi(self):
+        self.writeline("*CLS") #clear status
+
+    def _send(self, data):
+        self.sock.sendall(data)
+
+    def _recv_into(self, view, timeout):
+        self.sock.settimeout(max(timeout, 0.001))
+        try:
+            n = self.sock.recv_into(view)
+        except socket.timeout:
+            return 0
+        if n == 0:
+            raise CommunicationException("The connection to {:s}:{:d} was closed".format(*self.address))
+        return n
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,68 @@
+"""
+Helpers to wait until the oszi is ready, instead of sleeping a worst case time
+
+All functions work with any connection object (serialConnection.SerialComm,
+GPIBConnection.GPIBComm) and raise a TimeoutException if the oszi is not
+ready within timeout sec.
+
+wait_opc - "*OPC?" handshake, the oszi answers as soon as all pending operations are done
+wait_not_busy - poll "BUSY?" until the oszi reports 0
+wait_status_byte - "*OPC" and serial polls of the status byte (GPIB only), no message traffic while waiting
+wait_acquisition - poll "ACQ:STATE?" until a single sequence acquisition (ACQ:STOPA SEQ) is complete
+"""
+
+import time
+
+from scopeExceptions import CommunicationException, TimeoutException
+import metrics
+
+ESB = 32 #event status bit of the status byte
+
+def _last_token(answer):
+    #with "HEAD ON" the oszi may prepend the header, e.g. ":BUSY 0"
+    return answer.strip().split()[-1]
+
+def _poll(condition, timeout, poll_interval, max_interval, metrics=metrics.NULL_METRICS):
+    """Call condition() with growing intervals until it returns True"""
+    deadline = time.time() + timeout
+    interval = poll_interval
+    while not condition():
+        metrics.count("poll_iterations")
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            metrics.count("timeouts")
+            raise TimeoutException("The oszi was not ready within {:.2f}sec".format(timeout))
+        time.sleep(min(interval, remaining))
+        interval = min(interval*2, max_interval)
+
+def wait_opc(con, timeout=5):
+    """Send "*OPC?" and wait for the answer of the oszi"""
+    con.writeline("*OPC?")
+    answer = con.readline(timeout)
+    if _last_token(answer) != "1":
+        raise CommunicationException("Unexpected answer to *OPC?: "+repr(answer))
+
+def wait_not_busy(con, timeout=5, poll_interval=0.01, max_interval=0.2):
+    """Poll "BUSY?" until the oszi is not busy anymore"""
+    _poll(lambda: _last_token(con.query("BUSY?")) == "0", timeout, poll_interval, max_interval,
+          getattr(con, 'metrics', metrics.NULL_METRICS))
+
+def wait_acquisition(con, timeout=5, poll_interval=0.01, max_interval=0.5):
+    """
+    Poll "ACQ:STATE?" until the oszi stopped after a single sequence
+
+    The interval grows up to max_interval, so waiting a long time for a rare
+    trigger event costs only a few queries.
+    """
+    _poll(lambda: _last_token(con.query("ACQ:STATE?")) == "0", timeout, poll_interval, max_interval,
+          getattr(con, 'metrics', metrics.NULL_METRICS))
+
+def wait_status_byte(con, timeout=5, poll_interval=0.001, max_interval=0.05):
+    """
+    Let the oszi set the operation complete bit and wait for it by serial polls
+
+    The connection needs a read_stb() method (serial poll), so this works only with GPIB.
+    """
+    con.writeline("*CLS;*ESE 1;*OPC") #only the operation complete event sets the ESB bit
+    _poll(lambda: con.read_stb() & ESB, timeout, poll_interval, max_interval,
+          getattr(con, 'metrics', metrics.NULL_METRICS))
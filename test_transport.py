@@ -0,0 +1,35 @@
+"""
+Tests of the backend registry of transport.py
+
+run: python -m pytest test_transport.py (or python -m unittest test_transport)
+"""
+
+import unittest
+
+from scopeExceptions import InvalidArgumentException
+import transport
+
+
+class FindBackendTest(unittest.TestCase):
+
+    def test_serial_device_files(self):
+        for address in ("/dev/ttyUSB0", "/dev/ttyS1", "/dev/cu.usbserial", "/dev/pts/3",
+                        "/dev/serial/by-id/usb-FTDI_FT232R_USB_UART_A1234-if00-port0"):
+            self.assertEqual(transport.find_backend(address), "serial", address)
+
+    def test_usbtmc_wins_over_dev(self):
+        self.assertEqual(transport.find_backend("/dev/usbtmc0"), "usbtmc")
+        self.assertEqual(transport.find_backend("/dev/usbtmc12"), "usbtmc")
+
+    def test_other_backends(self):
+        self.assertEqual(transport.find_backend("COM1"), "serial")
+        self.assertEqual(transport.find_backend("GPIB0::1::INSTR"), "visa")
+        self.assertEqual(transport.find_backend("tcp://192.168.0.20:4001"), "socket")
+        self.assertEqual(transport.find_backend("SIM::GPIB"), "simulator")
+
+    def test_unknown_address(self):
+        self.assertRaises(InvalidArgumentException, transport.find_backend, "foo")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,336 @@
+"""
+Interface of the connections to the oszi and the registry of the backends
+
+Every connection (SerialComm, GPIBComm, SocketComm, USBTMCComm, SimulatedTDS210)
+implements Transport:
+    writeline(message) - send one command line
+    readline(timeout) - read one answer line
+    query(message, timeout) - writeline + readline
+    read_block(expected_bytes, timeout) - read an IEEE-488.2 block (the answer to CURV?)
+    wait_ready(timeout), wait_acquisition(timeout) - see synchronization.py
+    clear() - drop answers not read yet
+    resync(timeout) - skip the rest of an interrupted answer (see Scope.resync)
+    close()
+All timeouts are in sec and are deadlines for the whole call.
+
+The backend is chosen by the start of the address (see BACKENDS), new backends
+can be added with register():
+    transport.register("mylink", ("MYLINK::",), lambda address, baudrate, timeout, eol, **options: MyComm(address))
+    myscope = scope.Scope("MYLINK::1")
+"""
+
+import collections
+import time
+
+from scopeExceptions import CommunicationException, InvalidArgumentException, TimeoutException
+import synchronization
+import metrics
+
+RESYNC_QUERY = "ID?"
+RESYNC_MARKER = b"TEK/" #in the answer to RESYNC_QUERY, e.g. "ID TEK/TDS 210,CF:91.1CT,..."
+SALVAGE_TIMEOUT = 0.5 #sec to wait for the line end after the complete data of a block
+
+class Transport(object):
+    """Base class of the connections"""
+
+    metrics = metrics.NULL_METRICS #see metrics.py
+    timeout = 5
+
+    def writeline(self, message):
+        raise NotImplementedError
+
+    def readline(self, timeout=None):
+        raise NotImplementedError
+
+    def read_block(self, expected_bytes=None, timeout=None):
+        raise NotImplementedError
+
+    def readline_raw(self, min_bytes=0):
+        """Read the raw answer (including the line termination), kept for old scripts"""
+        raise NotImplementedError
+
+    def write(self, message):
+        self.writeline(message)
+
+    def query(self, msg, timeout=None):
+        self.writeline(msg)
+        return self.readline(timeout)
+
+    def wait_ready(self, timeout=None):
+        """Block until the oszi has finished all pending operations (*OPC? handshake)"""
+        synchronization.wait_opc(self, self.timeout if timeout is None else timeout)
+
+    def wait_acquisition(self, timeout=None):
+        """Block until a single sequence acquisition is complete (polls ACQ:STATE?)"""
+        synchronization.wait_acquisition(self, self.timeout if timeout is None else timeout)
+
+    def clear(self):
+        pass
+
+    def resync(self, timeout=None):
+        """
+        Skip the rest of an interrupted answer, e.g. half a curve still on its way
+
+        Data that did not arrive yet can not be flushed, so the marker query ID? is sent
+        and everything up to its answer is skipped; afterwards the next answer belongs
+        to the next query again. Needs the primitive _read_until(terminator, deadline).
+        """
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        self.clear()
+        self.writeline(RESYNC_QUERY)
+        self._read_until(RESYNC_MARKER, deadline)
+        self._read_until(b'\n', deadline)
+
+    def _read_block(self, expected_bytes, deadline):
+        """
+        Read an IEEE-488.2 block with the primitives _read_until and _read_exact(size, deadline)
+
+        Everything in front of the header is skipped, see BlockHeader. If the line end
+        after the complete data does not arrive, the data is returned anyway (counted
+        as "salvaged") and the input is cleared.
+        """
+        header = BlockHeader(expected_bytes)
+        while not header.complete:
+            if header.lost:
+                header.feed(self._read_until(b'#', deadline)[-1:])
+            else:
+                header.feed(bytes(self._read_exact(1, deadline)))
+        length = header.length
+        if length is None:
+            #indefinite length block, only terminated by the line end
+            return self._read_until(b'\n', deadline).rstrip(b'\r\n')
+        data = self._read_exact(length, deadline)
+        try:
+            self._read_until(b'\n', min(deadline, time.time() + SALVAGE_TIMEOUT))
+        except TimeoutException:
+            self.metrics.count("salvaged")
+            self.clear()
+        self.metrics.count("bytes_read", length)
+        return data
+
+    def close(self):
+        pass
+
+
+class BlockHeader(object):
+    """
+    Parser of the header '#<n><n digits: length>' of an IEEE-488.2 block
+
+    feed() gets the answer byte by byte from the first '#' on. A '#' that is not
+    followed by a syntactically valid header is taken for noise: lost becomes True and
+    the caller has to skip to the next '#' (a '#' inside the header starts a new one
+    right away). A valid header that announces another length than expected_bytes
+    raises a CommunicationException at once, the rest of the answer is left to
+    Scope.resync. Once complete is True, length holds the number of data bytes
+    (None for an indefinite length block '#0', terminated by the line end; with
+    expected_bytes a '#0' is taken for noise as well).
+    """
+
+    def __init__(self, expected_bytes=None):
+        self.expected_bytes = expected_bytes
+        self.lost = True #no '#' found yet
+        self.complete = False
+        self.length = None
+        self._n_digits = None
+        self._digits = b""
+
+    def feed(self, c):
+        if c == b'#':
+            self.lost = False
+            self._n_digits = None
+            self._digits = b""
+            return
+        if self.lost:
+            return
+        if not c.isdigit():
+            self.lost = True #a '#' in noise
+        elif self._n_digits is None:
+            self._n_digits = int(c)
+            if self._n_digits == 0 and self.expected_bytes is not None:
+                self.lost = True #a definite length block was requested, so '#0' is noise
+        else:
+            self._digits += c
+        if self.lost or self._n_digits is None or len(self._digits) < self._n_digits:
+            return
+        self.complete = True
+        if self._n_digits:
+            self.length = int(self._digits)
+            if self.expected_bytes is not None and self.length != self.expected_bytes:
+                raise CommunicationException("Expected a block of {:d} bytes, but the oszi announced {:d}".format(self.expected_bytes, self.length))
+
+
+def find_block(answer, expected_bytes=None):
+    """
+    Locate the data of the IEEE-488.2 block in a complete answer (e.g. of VISA), see BlockHeader
+
+    Returns (start, length) of the data in answer, length is None for an indefinite
+    length block.
+    """
+    header = BlockHeader(expected_bytes)
+    i = 0
+    while not header.complete:
+        if header.lost:
+            i = answer.find(b'#', i)
+            if i < 0:
+                raise CommunicationException("No block header in the answer of the oszi")
+        elif i >= len(answer):
+            raise CommunicationException("Incomplete block header in the answer of the oszi")
+        header.feed(answer[i:i+1])
+        i += 1
+    return i, header.length
+
+
+class StreamTransport(Transport):
+    """
+    Transport on top of a byte stream (socket, device file)
+
+    Subclasses implement _send(data) and _recv_into(view, timeout), which returns
+    the number of received bytes or 0 on a timeout. Small reads go through a receive
+    buffer of chunk_size bytes, the data of a block is received directly into a
+    bytearray of the announced size, so a large curve is neither split into many
+    small reads nor copied. Answers end with LF (GPIB, USBTMC) or CRLF (RS232 of the
+    oszi behind a serial server), both are accepted; eol is appended to the commands.
+    """
+
+    def __init__(self, timeout=5, eol='\r\n', chunk_size=65536):
+        self.timeout = timeout
+        self.eol = eol
+        self._buffer = bytearray(chunk_size)
+        self._start = 0 #received data not read yet: self._buffer[self._start:self._end]
+        self._end = 0
+
+    def _send(self, data):
+        raise NotImplementedError
+
+    def _recv_into(self, view, timeout):
+        raise NotImplementedError
+
+    def _fill(self, deadline):
+        """Receive more data into the buffer"""
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            if self._start > 0:
+                n = self._end - self._start
+                self._buffer[:n] = self._buffer[self._start:self._end]
+                self._start, self._end = 0, n
+            else:
+                self._buffer.extend(bytearray(len(self._buffer))) #a line longer than the buffer
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            self.metrics.count("timeouts")
+            raise TimeoutException("Timeout while reading from the oszi")
+        self.metrics.count("poll_iterations")
+        self._end += self._recv_into(memoryview(self._buffer)[self._end:], remaining)
+
+    def _read_until(self, terminator, deadline):
+        """Return the received bytes up to and including terminator"""
+        searched = 0 #bytes after self._start that do not contain the terminator
+        while True:
+            i = self._buffer.find(terminator, self._start + searched, self._end)
+            if i >= 0:
+                i += len(terminator)
+                out = bytes(self._buffer[self._start:i])
+                self._start = i
+                return out
+            searched = max(0, self._end - self._start - len(terminator) + 1)
+            self._fill(deadline) #may move the data to the start of the buffer
+
+    def _read_exact(self, size, deadline):
+        out = bytearray(size)
+        self._read_exact_into(memoryview(out), deadline)
+        return out
+
+    def _read_exact_into(self, view, deadline):
+        """Fill view with the next bytes, the buffered ones first"""
+        n = min(len(view), self._end - self._start)
+        view[:n] = self._buffer[self._start:self._start+n]
+        self._start += n
+        while n < len(view):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.metrics.count("timeouts")
+                raise TimeoutException("Timeout while reading: got {:d} of {:d} bytes".format(n, len(view)))
+            self.metrics.count("poll_iterations")
+            n += self._recv_into(view[n:], remaining)
+
+    def writeline(self, message):
+        data = (message+self.eol).encode('ascii')
+        self._send(data)
+        self.metrics.count("bytes_written", len(data))
+
+    def readline(self, timeout=None):
+        out = self._read_until(b'\n', time.time() + (self.timeout if timeout is None else timeout))
+        self.metrics.count("bytes_read", len(out))
+        return out.decode('ascii').replace('\r\n', '\n')
+
+    def readline_raw(self, min_bytes=0):
+        return self._read_until(b'\n', time.time() + self.timeout).replace(b'\r\n', b'\n')
+
+    def read_block(self, expected_bytes=None, timeout=None):
+        """Read an IEEE-488.2 definite length block, see SerialComm.read_block"""
+        return self._read_block(expected_bytes, time.time() + (self.timeout if timeout is None else timeout))
+
+    def clear(self, quiet=0.1):
+        """Drop everything received until nothing arrives for quiet sec"""
+        self._start = self._end = 0
+        view = memoryview(self._buffer)
+        while self._recv_into(view, quiet):
+            pass
+
+
+# ---- registry of the backends ----
+
+def _simulator(address, baudrate, timeout, eol, **options):
+    import simulator
+    return simulator.SimulatedTDS210(address, baudrate, timeout=timeout, eol=eol, **options)
+
+def _serial(address, baudrate, timeout, eol, **options):
+    import serialConnection
+    return serialConnection.SerialComm(address, baudrate, timeout=timeout, eol=eol) #timeout in s
+
+def _visa(address, baudrate, timeout, eol, **options):
+    import GPIBConnection
+    return GPIBConnection.GPIBComm(address, timeout=timeout*1000, eol=eol, **options) #timeout in ms
+
+def _socket(address, baudrate, timeout, eol, **options):
+    import socketConnection
+    return socketConnection.SocketComm(address, timeout=timeout, eol=eol, **options)
+
+def _usbtmc(address, baudrate, timeout, eol, **options):
+    import usbtmcConnection
+    return usbtmcConnection.USBTMCComm(address, timeout=timeout, eol=eol, **options)
+
+BACKENDS = collections.OrderedDict() #name -> (address prefixes, factory)
+
+def register(name, prefixes, factory):
+    """
+    Register a backend for the addresses starting with one of the prefixes (case insensitive)
+
+    factory is called as factory(address, baudrate, timeout, eol, **options) with the
+    timeout in sec and has to return the connection. Registering an existing name
+    replaces the backend.
+    """
+    BACKENDS[name] = (tuple(p.upper() for p in prefixes), factory)
+
+def find_backend(address):
+    """Return the name of the backend for the address, the longest matching prefix wins"""
+    best = None
+    best_length = -1
+    for name, (prefixes, factory) in BACKENDS.items():
+        for prefix in prefixes:
+            if address.upper().startswith(prefix) and len(prefix) > best_length:
+                best, best_length = name, len(prefix)
+    if best is None:
+        raise InvalidArgumentException("No connection type for the address "+repr(address))
+    return best
+
+def open_transport(address, baudrate=9600, timeout=5, eol='\r\n', **options):
+    """Open the connection for the address with the registered backend"""
+    return BACKENDS[find_backend(address)][1](address, baudrate, timeout, eol, **options)
+
+register("simulator", ("SIM",), _simulator)
+register("serial", ("COM", "\\\\.\\COM", "/dev/"), _serial) #any device file that is not matched by a longer prefix
+register("visa", ("GPIB", "TCPIP", "USB", "ASRL", "VXI"), _visa)
+register("socket", ("tcp://", "socket://"), _socket)
+register("usbtmc", ("/dev/usbtmc",), _usbtmc)
@@ -0,0 +1,76 @@
+from __future__ import print_function
+import errno
+import fcntl
+import os
+import struct
+
+from scopeExceptions import CommunicationException
+import transport
+
+"""
+USB connection over the USBTMC driver of the Linux kernel (the TDS1000/TDS2000 successors
+of the TDS210 have a USB device port), no VISA installation needed.
+The user needs read and write access to the device file, e.g. by a udev rule:
+SUBSYSTEM=="usbmisc", KERNEL=="usbtmc*", MODE="0666"
+
+address: the device file, e.g. "/dev/usbtmc0"
+"""
+
+USBTMC_IOCTL_CLEAR = 0x5b02        #_IO('[', 2)
+USBTMC_IOCTL_SET_TIMEOUT = 0x40045b0a #_IOW('[', 10, __u32), Linux 4.19+
+
+
+class USBTMCComm(transport.StreamTransport):
+    """
+    Connection through a /dev/usbtmc* device file
+
+    Every read of the device file requests one answer from the oszi, so the reads
+    are as large as the receive buffer (chunk_size) resp. the rest of a block.
+    Keyword arguments: see transport.StreamTransport
+    """
+
+    def __init__(self, address, timeout=5, eol='\n', chunk_size=65536):
+        transport.StreamTransport.__init__(self, timeout, '\n', chunk_size) #USBTMC messages end with LF
+        try:
+            self.fd = os.open(address, os.O_RDWR)
+        except OSError as e:
+            raise CommunicationException("Cannot open {:s}: {!s}".format(address, e))
+        self._driver_timeout = None
+        self.do_init_oszi()
+
+    def do_init_oszi(self):
+        self.writeline("*CLS") #clear status
+
+    def _set_driver_timeout(self, timeout):
+        ms = max(int(timeout*1000), 1)
+        if ms != self._driver_timeout:
+            try:
+                fcntl.ioctl(self.fd, USBTMC_IOCTL_SET_TIMEOUT, struct.pack("I", ms))
+            except (IOError, OSError):
+                pass #older kernel: the fixed timeout of the driver (5 sec) applies
+            self._driver_timeout = ms
+
+    def _send(self, data):
+        view = memoryview(data)
+        while len(view):
+            view = view[os.write(self.fd, view):]
+
+    def _recv_into(self, view, timeout):
+        self._set_driver_timeout(timeout)
+        try:
+            return os.readv(self.fd, [view])
+        except OSError as e:
+            if e.errno == errno.ETIMEDOUT:
+                return 0
+            raise CommunicationException("USBTMC read failed: {!s}".format(e))
+
+    def clear(self, quiet=0.1):
+        """Device clear, the oszi drops pending answers"""
+        try:
+            fcntl.ioctl(self.fd, USBTMC_IOCTL_CLEAR)
+        except (IOError, OSError):
+            pass
+        self._start = self._end = 0
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,205 @@
+"""
+Decoding of the raw curve data sent by the oszi
+
+These functions do not need a connection, so they can also be used to decode
+stored raw curves offline.
+
+usage:
+    preamble = waveform.parse_preamble(":WFMPRE:XINCR 1.0E-3;:WFMPRE:XZERO -1.25E0;...")
+    volts = waveform.decode_curve(raw_bytes, preamble, byte_wid=1)
+    x = waveform.x_axis(preamble['XZERO'], preamble['XINCR'], len(volts))
+"""
+
+import numpy as np
+
+SAMPLE_DTYPES = {1: np.dtype('b'), 2: np.dtype('>i2')} #data width in bytes -> encoding of "DAT:ENC RIB"
+PREAMBLE_KEYS = ('XINCR', 'XZERO', 'YMULT', 'YZERO', 'YOFF')
+
+_x_axis_cache = {}
+_X_AXIS_CACHE_SIZE = 16
+
+def parse_preamble(answer):
+    """
+    Parse the answer of "WFMPRe:XINCR?;XZERO?;YMULT?;YZERO?;YOFF?" into a dict of floats
+
+    The answer has to contain the headers (HEAD ON), e.g. ":WFMPRE:XINCR 1.0E-3;:WFMPRE:XZERO -1.25E0".
+    """
+    params = {}
+    for s in answer.strip().split(';'):
+        header, value = s.split(" ", 1) #now split on the space sign
+        params[header.split(':')[-1]] = float(value)
+    return params
+
+def decode_samples(raw, byte_wid=1):
+    """Return the raw samples of a curve as int8/int16 array without copying the received bytes"""
+    return np.frombuffer(raw, dtype=SAMPLE_DTYPES[byte_wid])
+
+def decode_curve(raw, preamble, byte_wid=1, out=None, dtype=np.float64, stride=1):
+    """
+    Convert the raw curve bytes into Volts: (raw - YOFF) * YMULT + YZERO
+
+    Arguments:
+    raw - the data bytes of the "CURV?" block (without the '#42500' header)
+    preamble - dict with (at least) YOFF, YMULT and YZERO
+
+    Keyword arguments:
+    byte_wid - 1 or 2 bytes per data point (DAT:WID)
+    out - array to write the result into, must have the length of the (strided) data
+    dtype - dtype of the result if no out array is given, e.g. np.float32 (default: np.float64)
+    stride - use only every stride-th data point
+
+    Returns the array with the data in Volts (out, if it was given)
+    """
+    samples = decode_samples(raw, byte_wid)[::stride]
+    if out is None:
+        out = np.empty(len(samples), dtype=dtype)
+    np.subtract(samples, preamble['YOFF'], out=out)
+    out *= preamble['YMULT']
+    if preamble['YZERO']:
+        out += preamble['YZERO']
+    return out
+
+def x_axis(xzero, xincr, n):
+    """
+    Return the time axis xzero + i*xincr for i in 0..n-1
+
+    The arrays are cached, so the same axis is not computed again for every frame.
+    The returned array is read-only, copy it before changing it in place.
+    """
+    key = (xzero, xincr, n)
+    x = _x_axis_cache.get(key)
+    if x is None:
+        if len(_x_axis_cache) >= _X_AXIS_CACHE_SIZE:
+            _x_axis_cache.clear()
+        x = np.arange(n)*xincr
+        x += xzero
+        x.setflags(write=False)
+        _x_axis_cache[key] = x
+    return x
+
+
+class WaveformBatch:
+    """
+    Frames of raw samples with their preambles and timestamps
+
+    The samples are stored as they are sent by the oszi (int8 for 1 byte, int16 for
+    2 bytes per data point) in one contiguous array of shape (frames, channels, points),
+    which needs only 1/8 resp. 1/4 of the memory of float64 data. The conversion to Volts
+    is done only when the data is accessed:
+
+        batch = myscope.read_batch(100, "CH1CH2")
+        volts = batch[10]          #frame 10, shape (channels, points)
+        volts = batch[10:20, 0]    #frames 10..19 of the first channel
+        x = batch.x(10)            #time axis of frame 10
+
+    The batch grows automatically when more than capacity frames are appended.
+    """
+
+    def __init__(self, n_channels, n_points, byte_wid=1, capacity=64, start=1, stride=1):
+        self.byte_wid = byte_wid
+        self.start = start   #first point of the record (DAT:STAR) of the samples
+        self.stride = stride #only every stride-th point was kept
+        self._raw = np.empty((capacity, n_channels, n_points), dtype=SAMPLE_DTYPES[byte_wid].newbyteorder('='))
+        self._preambles = np.empty((capacity, n_channels, len(PREAMBLE_KEYS)))
+        self._timestamps = np.empty(capacity)
+        self._n = 0
+
+    @classmethod
+    def from_arrays(cls, raw, preambles, timestamps, byte_wid=1, start=1, stride=1):
+        """
+        Create a batch using the given arrays without copying them (e.g. np.memmap of a capture file)
+
+        raw - samples, shape (frames, channels, points)
+        preambles - shape (frames, channels, 5), in the order of PREAMBLE_KEYS
+        timestamps - shape (frames,)
+        """
+        batch = cls.__new__(cls)
+        batch.byte_wid = byte_wid
+        batch.start = start
+        batch.stride = stride
+        batch._raw = raw
+        batch._preambles = preambles
+        batch._timestamps = timestamps
+        batch._n = len(raw)
+        return batch
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def n_channels(self):
+        return self._raw.shape[1]
+
+    @property
+    def n_points(self):
+        return self._raw.shape[2]
+
+    @property
+    def raw(self):
+        """The raw samples, shape (frames, channels, points)"""
+        return self._raw[:self._n]
+
+    @property
+    def preambles(self):
+        """The preambles, shape (frames, channels, 5), the last axis in the order of PREAMBLE_KEYS"""
+        return self._preambles[:self._n]
+
+    @property
+    def timestamps(self):
+        """Host timestamps of the frames"""
+        return self._timestamps[:self._n]
+
+    def _grow(self):
+        capacity = 2*len(self._raw)
+        for name in ('_raw', '_preambles', '_timestamps'):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self, name, new)
+
+    def append(self, samples, preambles, timestamp):
+        """
+        Append one frame
+
+        samples - one array of raw samples per channel (e.g. from decode_samples)
+        preambles - one preamble dict per channel
+        timestamp - host time of the frame
+        """
+        if self._n == len(self._raw):
+            self._grow()
+        for i in range(self.n_channels):
+            self._raw[self._n, i] = samples[i]
+            self._preambles[self._n, i] = [preambles[i][key] for key in PREAMBLE_KEYS]
+        self._timestamps[self._n] = timestamp
+        self._n += 1
+
+    def preamble(self, frame, channel=0):
+        """Return the preamble of a frame as dict"""
+        return dict(zip(PREAMBLE_KEYS, self.preambles[frame, channel]))
+
+    def volts(self, frames=slice(None), channels=slice(None), dtype=np.float64):
+        """
+        Convert the selected frames and channels to Volts
+
+        frames and channels are used as numpy indices, e.g. an int or a slice.
+        """
+        raw = self.raw[frames, channels]
+        p = self.preambles[frames, channels]
+        yoff = p[..., PREAMBLE_KEYS.index('YOFF'), np.newaxis]
+        ymult = p[..., PREAMBLE_KEYS.index('YMULT'), np.newaxis]
+        yzero = p[..., PREAMBLE_KEYS.index('YZERO'), np.newaxis]
+        out = np.subtract(raw, yoff, dtype=dtype)
+        out *= ymult
+        out += yzero
+        return out
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            return self.volts(*index)
+        return self.volts(index)
+
+    def x(self, frame, channel=0):
+        """Time axis of a frame (read-only, see x_axis)"""
+        xincr = self.preambles[frame, channel, PREAMBLE_KEYS.index('XINCR')]
+        xzero = self.preambles[frame, channel, PREAMBLE_KEYS.index('XZERO')]
+        return x_axis(xzero + (self.start - 1)*xincr, self.stride*xincr, self.n_points)